@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+DMARC Parser Benchmarks - Measure parsing, reporting, export and IMAP fetch speed
+
+Generates synthetic aggregate reports (configurable record count, IPv4/IPv6
+mix, failure ratio and xml/gz/zip wrapping) and reports throughput and peak
+memory for each stage. IMAP fetches run against fake_imap_server.py in a
+separate process. Results can be saved with --json and compared with a
+previous run with --baseline, which exits non-zero on regressions.
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import ipaddress
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime
+
+from dmarc_parser import Colors, DMARCParser, FETCH_BATCH_SIZE
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def generate_report_xml(records=1000, ipv6_ratio=0.1, failure_ratio=0.05, domain='example.com',
+                        org_name='google.com', report_id='1', begin=1735689600, policy='quarantine', seed=0):
+    """Return an aggregate report (bytes) with `records` <record> elements
+
+    Source IPs are random public-looking IPv4 addresses or addresses in
+    2001:db8::/32, message counts are heavy-tailed, and failure_ratio of the
+    records fail DKIM, SPF or both (the disposition follows the policy when
+    both fail).
+    """
+    rng = random.Random(seed)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8" ?>\n<feedback>\n  <version>1.0</version>\n'
+        '  <report_metadata>\n'
+        f'    <org_name>{org_name}</org_name>\n'
+        f'    <email>noreply-dmarc-support@{org_name}</email>\n'
+        f'    <report_id>{report_id}</report_id>\n'
+        f'    <date_range>\n      <begin>{begin}</begin>\n      <end>{begin + 86399}</end>\n    </date_range>\n'
+        '  </report_metadata>\n'
+        '  <policy_published>\n'
+        f'    <domain>{domain}</domain>\n    <adkim>r</adkim>\n    <aspf>r</aspf>\n'
+        f'    <p>{policy}</p>\n    <sp>{policy}</sp>\n    <pct>100</pct>\n'
+        '  </policy_published>\n'
+    ]
+    for _ in range(records):
+        if rng.random() < ipv6_ratio:
+            source_ip = str(ipaddress.IPv6Address(0x20010db8 << 96 | rng.getrandbits(96)))
+        else:
+            source_ip = f'{rng.randint(1, 223)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randint(1, 254)}'
+        if rng.random() < failure_ratio:
+            dkim, spf = rng.choice((('fail', 'pass'), ('pass', 'fail'), ('fail', 'fail')))
+        else:
+            dkim, spf = 'pass', 'pass'
+        disposition = policy if dkim == spf == 'fail' else 'none'
+        count = min(int(rng.paretovariate(1.2)), 100000)
+        parts.append(
+            '  <record>\n    <row>\n'
+            f'      <source_ip>{source_ip}</source_ip>\n      <count>{count}</count>\n'
+            '      <policy_evaluated>\n'
+            f'        <disposition>{disposition}</disposition>\n        <dkim>{dkim}</dkim>\n        <spf>{spf}</spf>\n'
+            '      </policy_evaluated>\n    </row>\n'
+            f'    <identifiers>\n      <header_from>{domain}</header_from>\n    </identifiers>\n'
+            '    <auth_results>\n'
+            f'      <dkim>\n        <domain>{domain}</domain>\n        <selector>s{rng.randint(1, 3)}</selector>\n'
+            f'        <result>{dkim}</result>\n      </dkim>\n'
+            f'      <spf>\n        <domain>bounces.{domain}</domain>\n        <scope>mfrom</scope>\n'
+            f'        <result>{spf}</result>\n      </spf>\n'
+            '    </auth_results>\n  </record>\n'
+        )
+    parts.append('</feedback>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def wrap_report(xml, compression='gz', name='report'):
+    """Return (file_data, filename) for a report as .xml, .xml.gz or .zip, as reporters send them"""
+    if compression == 'xml':
+        return xml, f'{name}.xml'
+    if compression == 'gz':
+        return gzip.compress(xml), f'{name}.xml.gz'
+    if compression == 'zip':
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(f'{name}.xml', xml)
+        return buffer.getvalue(), f'{name}.zip'
+    raise ValueError(f'unknown compression: {compression}')
+
+
+def measure(run, repeat=3, memory=True):
+    """Return (best wall time in seconds, peak traced memory in bytes or None)
+
+    Timing runs are done without tracemalloc, which slows allocation-heavy
+    code several times over; peak memory comes from one extra traced run.
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def parsed(file_data, filename, stream=False):
+    """Return a DMARCParser that has parsed one report attachment"""
+    parser = DMARCParser('bench@example.com', '', stream=stream)
+    with quiet():
+        parser.parse_dmarc_xml(file_data, filename, 'bench@example.com', 'benchmark')
+        parser.finish_parsing()
+    return parser
+
+
+def bench_parse(args, results):
+    for records in args.records:
+        xml = generate_report_xml(records, args.ipv6_ratio, args.failure_ratio, seed=args.seed)
+        for compression in args.compression:
+            file_data, filename = wrap_report(xml, compression)
+            for stream in (False, True):
+                seconds, peak = measure(lambda: parsed(file_data, filename, stream), args.repeat)
+                results.append(result('parse_dmarc_xml', f'{records} records {compression}'
+                                      f'{" --stream" if stream else ""}', seconds, records, 'records', peak,
+                                      len(xml)))
+
+
+def bench_report(args, results):
+    for records in args.records:
+        xml = generate_report_xml(records, args.ipv6_ratio, args.failure_ratio, seed=args.seed)
+        parser = parsed(xml, 'report.xml')
+        failures = len(parser.failures)
+        for detailed in (False, True):
+            def run():
+                with quiet():
+                    parser.generate_report(detailed=detailed)
+            seconds, peak = measure(run, args.repeat)
+            results.append(result('generate_report', f'{failures} failures{" --detailed" if detailed else ""}',
+                                  seconds, failures, 'failures', peak))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'out.json')
+            for compact in (False, True):
+                def run():
+                    with quiet():
+                        parser.export_to_json(path, compact=compact)
+                seconds, peak = measure(run, args.repeat)
+                results.append(result('export_to_json', f'{records} records{" compact" if compact else ""}',
+                                      seconds, records, 'records', peak, os.path.getsize(path)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def fake_imap_server(args):
+    """Serve args.emails generated reports from fake_imap_server.py in a child process"""
+    with tempfile.TemporaryDirectory() as directory:
+        for index in range(args.emails):
+            xml = generate_report_xml(args.email_records, args.ipv6_ratio, args.failure_ratio,
+                                      report_id=str(index), seed=args.seed + index)
+            file_data, filename = wrap_report(xml, args.compression[0], f'report{index:05d}')
+            with open(os.path.join(directory, filename), 'wb') as f:
+                f.write(file_data)
+        port = free_port()
+        server = subprocess.Popen([sys.executable, '-u', os.path.join(HERE, 'fake_imap_server.py'), directory,
+                                   '--port', str(port), '--latency', str(args.latency)],
+                                  stdout=subprocess.PIPE, text=True)
+        try:
+            server.stdout.readline()  # "Serving N messages on ..."
+            yield port
+        finally:
+            server.terminate()
+            server.wait()
+            server.stdout.close()
+
+
+def bench_fetch(args, results):
+    with fake_imap_server(args) as port:
+        for attachments_only in (False, True):
+            for workers in args.workers:
+                downloaded = []
+
+                def run():
+                    parser = DMARCParser('bench', 'bench', '127.0.0.1', port=port, use_ssl=False)
+                    with quiet():
+                        parser.connect()
+                        parser.fetch_dmarc_reports('INBOX', 0, args.batch_size, attachments_only=attachments_only,
+                                                   workers=workers)
+                        parser.disconnect()
+                    downloaded.append(parser.bytes_downloaded)
+                seconds, peak = measure(run, args.repeat)
+                results.append(result('fetch_dmarc_reports', f'{args.emails} emails workers={workers}'
+                                      f'{" --attachments-only" if attachments_only else ""}',
+                                      seconds, args.emails, 'emails', peak, downloaded[-1]))
+
+
+def result(benchmark, case, seconds, items, unit, peak, size=None):
+    return {
+        'benchmark': benchmark,
+        'case': case,
+        'seconds': round(seconds, 4),
+        'throughput': round(items / seconds, 1) if seconds else None,
+        'unit': f'{unit}/s',
+        'mb_per_second': round(size / seconds / 1e6, 2) if size and seconds else None,
+        'peak_mb': round(peak / 1e6, 2) if peak is not None else None,
+    }
+
+
+def print_results(results, baseline=None, tolerance=10.0):
+    """Print a results table; returns the number of regressions against the baseline"""
+    previous = {(r['benchmark'], r['case']): r for r in (baseline or [])}
+    regressions = 0
+    print(f"\n{Colors.BOLD}{'Benchmark':<22} {'Case':<42} {'Seconds':>9} {'Throughput':>20} {'MB/s':>8} "
+          f"{'Peak MB':>8}{'  vs baseline' if baseline else ''}{Colors.END}")
+    for r in results:
+        line = (f"{r['benchmark']:<22} {r['case']:<42} {r['seconds']:>9.3f} "
+                f"{r['throughput']:>12.1f} {r['unit']:<7} {r['mb_per_second'] or '':>8} {r['peak_mb'] or '':>8}")
+        before = previous.get((r['benchmark'], r['case']))
+        if before and before['throughput'] and r['throughput']:
+            change = (r['throughput'] / before['throughput'] - 1) * 100
+            if change < -tolerance:
+                regressions += 1
+                line += f"  {Colors.RED}{change:+.1f}% REGRESSION{Colors.END}"
+            else:
+                line += f"  {Colors.GREEN if change >= 0 else Colors.YELLOW}{change:+.1f}%{Colors.END}"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the DMARC parser on synthetic reports')
+    parser.add_argument('--only', nargs='+', choices=('parse', 'report', 'fetch'),
+                        default=['parse', 'report', 'fetch'], help='Benchmarks to run (default: all)')
+    parser.add_argument('--records', type=int, nargs='+', default=[1000, 100000],
+                        help='Records per report for parse/report benchmarks (default: 1000 100000)')
+    parser.add_argument('--ipv6-ratio', type=float, default=0.2, help='Share of IPv6 source IPs (default: 0.2)')
+    parser.add_argument('--failure-ratio', type=float, default=0.05,
+                        help='Share of records failing DKIM and/or SPF (default: 0.05)')
+    parser.add_argument('--compression', nargs='+', choices=('xml', 'gz', 'zip'), default=['xml', 'gz', 'zip'],
+                        help='Attachment wrappings to parse; the first is used for IMAP emails (default: all)')
+    parser.add_argument('--emails', type=int, default=200, help='Emails served for the fetch benchmark (default: 200)')
+    parser.add_argument('--email-records', type=int, default=100, help='Records per emailed report (default: 100)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4],
+                        help='IMAP connection counts to fetch with (default: 1 4)')
+    parser.add_argument('--batch-size', type=int, default=FETCH_BATCH_SIZE, help='Emails per UID FETCH')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Artificial per-command latency of the fake IMAP server in seconds (default: 0)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case, best is reported (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for generated reports (default: 0)')
+    parser.add_argument('--json', metavar='FILE', help='Write results to a JSON file')
+    parser.add_argument('--baseline', metavar='FILE', help='Compare with results saved by --json; exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=10.0,
+                        help='Throughput drop in percent reported as a regression (default: 10)')
+    parser.add_argument('--generate', metavar='PATH',
+                        help='Only write one generated report (first --records size, .xml/.gz/.zip by extension)')
+    args = parser.parse_args()
+
+    if args.generate:
+        compression = 'zip' if args.generate.endswith('.zip') else 'gz' if args.generate.endswith('.gz') else 'xml'
+        xml = generate_report_xml(args.records[0], args.ipv6_ratio, args.failure_ratio, seed=args.seed)
+        file_data, _ = wrap_report(xml, compression)
+        with open(args.generate, 'wb') as f:
+            f.write(file_data)
+        print(f"Wrote {args.records[0]} records to {args.generate}")
+        return
+
+    results = []
+    benchmarks = {'parse': bench_parse, 'report': bench_report, 'fetch': bench_fetch}
+    for name in args.only:
+        print(f"{Colors.CYAN}Running {name} benchmarks...{Colors.END}")
+        benchmarks[name](args, results)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressions = print_results(results, baseline, args.tolerance)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'generated_at': datetime.now().isoformat(), 'python': sys.version.split()[0],
+                       'results': results}, f, indent=2)
+        print(f"\n{Colors.GREEN}✓ Results written to {args.json}{Colors.END}")
+    if regressions:
+        print(f"\n{Colors.RED}{regressions} benchmark(s) regressed by more than {args.tolerance}%{Colors.END}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,19 +7,37 @@ parses them, and identifies authentication failures (DKIM, SPF, DMARC alignment)
 """
 
 import imaplib
+import ipaddress
 import email
 from email.header import decode_header
+from email.utils import formataddr
 import xml.etree.ElementTree as ET
 import gzip
 import zipfile
 import io
 import os
 import json
+import mailbox as mailboxlib
+import multiprocessing
+import queue
+import sqlite3
+import statistics
+import threading
 import argparse
-from datetime import datetime
-from collections import defaultdict
+import bisect
+from datetime import datetime, timedelta
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
 import base64
+import hashlib
+import quopri
+import re
+import signal
+import socket
 import sys
+import time
+from itertools import takewhile
 from pathlib import Path
 
 
@@ -37,67 +55,2010 @@ class Colors:
     END = '\033[0m'
 
 
+# Search criteria for DMARC report emails, OR'd into a single UID SEARCH
+# Standard DMARC report subject format: "Report Domain: example.com Submitter: reporter.com"
+DMARC_SEARCH_CRITERIA = [
+    'SUBJECT "Report Domain:"',  # Standard DMARC report format
+    'FROM "dmarc"',               # From addresses containing dmarc
+    'SUBJECT "dmarc"',            # Subject containing dmarc
+    'FROM "noreply@google.com"',  # Google DMARC reports
+    'FROM "yahoo"',               # Yahoo DMARC reports
+    'FROM "postmaster"',          # Generic postmaster reports
+]
+
+# Number of messages requested per UID FETCH command
+FETCH_BATCH_SIZE = 500
+
+# Attempts per fetch batch on transient IMAP errors, with exponential backoff
+FETCH_RETRIES = 3
+RETRY_BACKOFF = 1.0
+
+# With --stream, parse workers hand records back in chunks of this many, with
+# at most PARSE_CHUNKS_QUEUED chunks per attachment waiting to be merged
+PARSE_CHUNK_RECORDS = 1000
+PARSE_CHUNKS_QUEUED = 2
+
+# Attachment extensions that may hold an aggregate report
+REPORT_EXTENSIONS = ('.xml', '.gz', '.zip')
+
+# Values accepted by --format
+OUTPUT_FORMATS = ('json', 'compact', 'ndjson', 'ndjson.gz')
+
+# Tokens of an IMAP response: parentheses, quoted strings, literal markers and
+# atoms (including section specs such as BODY[HEADER.FIELDS (SUBJECT)]<0>)
+_IMAP_TOKEN_RE = re.compile(
+    rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"\[\]{]+(?:\[[^\]]*\](?:<[\d.]+>)?)?))'
+)
+_OPEN, _CLOSE = object(), object()
+
+
+def build_search_query(criteria):
+    """Combine search criteria into one IMAP expression: OR c1 OR c2 c3"""
+    query = criteria[-1]
+    for criterion in reversed(criteria[:-1]):
+        query = f'OR {criterion} {query}'
+    return query
+
+
+def compress_uid_set(uids):
+    """Render sorted UIDs as a compact IMAP sequence set, e.g. '1:3,7,9:10'"""
+    ranges = []
+    start = prev = None
+    for uid in uids:
+        if start is None:
+            start = prev = uid
+        elif uid == prev + 1:
+            prev = uid
+        else:
+            ranges.append(f'{start}:{prev}' if start != prev else str(start))
+            start = prev = uid
+    if start is not None:
+        ranges.append(f'{start}:{prev}' if start != prev else str(start))
+    return ','.join(ranges)
+
+
+def _tokenize_imap(data):
+    """Yield tokens from imaplib response data, substituting literal payloads"""
+    for chunk in data:
+        if isinstance(chunk, tuple):
+            text, literal = chunk
+        else:
+            text, literal = chunk, None
+        if not isinstance(text, bytes):
+            continue
+        pos = 0
+        while pos < len(text):
+            match = _IMAP_TOKEN_RE.match(text, pos)
+            if not match or match.end() == pos:
+                break
+            pos = match.end()
+            if match.group(1):
+                yield _OPEN
+            elif match.group(2):
+                yield _CLOSE
+            elif match.group(3) is not None:
+                yield re.sub(rb'\\(.)', rb'\1', match.group(3))
+            elif match.group(4) is not None:
+                yield literal
+            else:
+                atom = match.group(5)
+                yield None if atom.upper() == b'NIL' else atom
+
+
+def _read_imap_list(tokens):
+    """Collect tokens up to the matching close paren into nested lists"""
+    items = []
+    for token in tokens:
+        if token is _CLOSE:
+            return items
+        items.append(_read_imap_list(tokens) if token is _OPEN else token)
+    return items
+
+
+def parse_fetch_response(data):
+    """Parse imaplib FETCH response data into a list of {ITEM: value} dicts"""
+    responses = []
+    tokens = _tokenize_imap(data)
+    for token in tokens:
+        # Each response is "<seq> (<item> <value> ...)"; the number is skipped
+        if token is not _OPEN:
+            continue
+        items = _read_imap_list(tokens)
+        responses.append({
+            items[i].decode().upper(): items[i + 1]
+            for i in range(0, len(items) - 1, 2) if isinstance(items[i], bytes)
+        })
+    return responses
+
+
+def is_report_subject(subject):
+    """Check whether an email subject looks like a DMARC report"""
+    return 'Report Domain:' in subject or 'dmarc' in subject.lower() or 'aggregate' in subject.lower()
+
+
+def _imap_text(value):
+    """Decode an IMAP string/literal/NIL value to text"""
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value)
+
+
+def _imap_params(value):
+    """Turn an IMAP parameter list ("NAME" "value" ...) into a lowercase-keyed dict"""
+    if not isinstance(value, list):
+        return {}
+    return {_imap_text(value[i]).lower(): _imap_text(value[i + 1]) for i in range(0, len(value) - 1, 2)}
+
+
+def find_report_parts(structure, section=''):
+    """Walk a BODYSTRUCTURE and return (section, filename, encoding) of report attachments"""
+    if structure and isinstance(structure[0], list):
+        # Multipart: child parts come first, followed by subtype and extension data
+        parts = []
+        for number, child in enumerate(takewhile(lambda item: isinstance(item, list), structure), 1):
+            parts.extend(find_report_parts(child, f'{section}.{number}' if section else str(number)))
+        return parts
+    
+    section = section or '1'
+    maintype = _imap_text(structure[0]).lower()
+    subtype = _imap_text(structure[1]).lower()
+    params = _imap_params(structure[2])
+    encoding = _imap_text(structure[5]).lower() or '7bit'
+    
+    # Extension data follows the type-specific fields
+    if maintype == 'text':
+        disposition_index = 9
+    elif maintype == 'message' and subtype == 'rfc822':
+        inner = structure[8]
+        if inner and isinstance(inner[0], list):
+            return find_report_parts(inner, section)
+        return find_report_parts(inner, f'{section}.1')
+    else:
+        disposition_index = 8
+    
+    filename = None
+    disposition = structure[disposition_index] if len(structure) > disposition_index else None
+    if isinstance(disposition, list) and len(disposition) > 1:
+        filename = _imap_params(disposition[1]).get('filename')
+    filename = filename or params.get('name')
+    if filename and filename.endswith(REPORT_EXTENSIONS):
+        return [(section, filename, encoding)]
+    return []
+
+
+def decode_transfer_encoding(data, encoding):
+    """Decode a body section fetched with BODY.PEEK[n]"""
+    if encoding == 'base64':
+        return base64.b64decode(data)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(data)
+    return data
+
+
+def open_report_streams(file_data, filename):
+    """Yield (name, binary stream) for each XML document in a report attachment
+    
+    Gzip and zip data are decompressed incrementally as the stream is read.
+    """
+    source = io.BytesIO(file_data) if isinstance(file_data, (bytes, bytearray)) else file_data
+    if filename.endswith('.gz'):
+        with gzip.GzipFile(fileobj=source) as stream:
+            yield filename, stream
+    elif filename.endswith('.zip'):
+        with zipfile.ZipFile(source) as zf:
+            for name in zf.namelist():
+                if name.endswith('.xml'):
+                    with zf.open(name) as stream:
+                        yield name, stream
+    elif filename.endswith('.xml'):
+        yield filename, source
+
+
+def is_maildir(path):
+    return all(os.path.isdir(os.path.join(path, sub)) for sub in ('cur', 'new', 'tmp'))
+
+
+def _classify_file(path):
+    if path.endswith(REPORT_EXTENSIONS):
+        return 'report'
+    if path.endswith('.eml'):
+        return 'email'
+    if path.endswith('.mbox'):
+        return 'mbox'
+    try:
+        with open(path, 'rb') as f:
+            if f.read(5) == b'From ':
+                return 'mbox'
+    except OSError as e:
+        print(f"{Colors.YELLOW}Warning: Could not read {path}: {e.strerror}{Colors.END}")
+    return None
+
+
+def iter_local_sources(paths):
+    """Yield (kind, path) for report files, .eml files, mbox files and Maildirs
+    
+    Directories are walked recursively in sorted order; a Maildir is yielded
+    as a whole rather than as individual message files.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            kind = _classify_file(path)
+            if kind:
+                yield kind, path
+            continue
+        if is_maildir(path):
+            yield 'maildir', path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in [d for d in dirs if is_maildir(os.path.join(root, d))]:
+                dirs.remove(name)
+                yield 'maildir', os.path.join(root, name)
+            for name in sorted(files):
+                kind = _classify_file(os.path.join(root, name))
+                if kind:
+                    yield kind, os.path.join(root, name)
+
+
+# Result values of <policy_evaluated> and <auth_results>, stored as small codes;
+# anything else is kept verbatim in DMARCRecord._other
+AUTH_RESULTS = ('pass', 'fail', 'none', 'softfail', 'neutral', 'temperror', 'permerror', 'policy')
+DISPOSITIONS = ('none', 'quarantine', 'reject')
+_AUTH_CODES = {value: code for code, value in enumerate(AUTH_RESULTS)}
+_DISPOSITION_CODES = {value: code for code, value in enumerate(DISPOSITIONS)}
+_IPV6_FLAG = 1 << 8
+
+# Shared (domain, result) tuples for auth details; most records repeat a handful
+_DETAILS = {}
+_DETAILS_LIMIT = 100000
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _pack_ip(source_ip):
+    """Return (int, is_ipv6) for a canonical IP address string, or None"""
+    for family, is_ipv6 in ((socket.AF_INET, False), (socket.AF_INET6, True)):
+        try:
+            packed = socket.inet_pton(family, source_ip)
+        except (OSError, TypeError, ValueError):
+            continue
+        # Only pack addresses that format back to the same text
+        if socket.inet_ntop(family, packed) == source_ip:
+            return int.from_bytes(packed, 'big'), is_ipv6
+        return None
+    return None
+
+
+def _shared_details(details):
+    key = tuple((_intern(domain), _intern(result)) for domain, result in details)
+    shared = _DETAILS.get(key)
+    if shared is None:
+        if len(_DETAILS) >= _DETAILS_LIMIT:
+            return key
+        shared = _DETAILS[key] = key
+    return shared
+
+
+class DMARCRecord:
+    """One parsed <record>, read like the dict parse_record used to return
+    
+    Results are packed into a single small int, strings are interned, the
+    source IP is kept as an integer and auth details as shared tuples.
+    """
+    
+    FIELDS = ('source_ip', 'count', 'disposition', 'dkim_result', 'spf_result', 'dkim_details', 'spf_details',
+              'header_from', 'has_failure')
+    __slots__ = ('_ip', 'count', '_flags', '_other', '_dkim', '_spf', 'header_from')
+    
+    def __init__(self, source_ip, count, disposition, dkim_result, spf_result, dkim_details=(), spf_details=(),
+                 header_from='N/A'):
+        packed = _pack_ip(source_ip)
+        if packed is None:
+            self._ip, flags = _intern(source_ip), 0
+        else:
+            self._ip, flags = packed[0], _IPV6_FLAG if packed[1] else 0
+        
+        codes = (_DISPOSITION_CODES.get(disposition), _AUTH_CODES.get(dkim_result), _AUTH_CODES.get(spf_result))
+        if None in codes:
+            self._other = (_intern(disposition), _intern(dkim_result), _intern(spf_result))
+        else:
+            self._other = None
+            flags |= codes[0] | codes[1] << 2 | codes[2] << 5
+        self._flags = flags
+        self.count = count
+        self._dkim = _shared_details(dkim_details)
+        self._spf = _shared_details(spf_details)
+        self.header_from = _intern(header_from)
+    
+    @property
+    def source_ip(self):
+        if isinstance(self._ip, int):
+            if self._flags & _IPV6_FLAG:
+                return socket.inet_ntop(socket.AF_INET6, self._ip.to_bytes(16, 'big'))
+            return socket.inet_ntop(socket.AF_INET, self._ip.to_bytes(4, 'big'))
+        return self._ip
+    
+    @property
+    def disposition(self):
+        return self._other[0] if self._other else DISPOSITIONS[self._flags & 3]
+    
+    @property
+    def dkim_result(self):
+        return self._other[1] if self._other else AUTH_RESULTS[self._flags >> 2 & 7]
+    
+    @property
+    def spf_result(self):
+        return self._other[2] if self._other else AUTH_RESULTS[self._flags >> 5 & 7]
+    
+    @property
+    def has_failure(self):
+        return self.dkim_result != 'pass' or self.spf_result != 'pass'
+    
+    @property
+    def dkim_details(self):
+        return [{'domain': domain, 'result': result} for domain, result in self._dkim]
+    
+    @property
+    def spf_details(self):
+        return [{'domain': domain, 'result': result} for domain, result in self._spf]
+    
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def keys(self):
+        return self.FIELDS
+    
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+    
+    def __reduce__(self):
+        # Pickle as plain values so strings are re-interned in the receiving process
+        return DMARCRecord, (self.source_ip, self.count, self.disposition, self.dkim_result, self.spf_result,
+                             self._dkim, self._spf, self.header_from)
+    
+    def __repr__(self):
+        return f'DMARCRecord({self.to_dict()!r})'
+
+
+class FailureRecord:
+    """A failing record plus a reference to its report, read like a flat dict"""
+    
+    FIELDS = ('domain', 'org_name', 'report_id', 'date') + DMARCRecord.FIELDS
+    __slots__ = ('report', 'record')
+    
+    def __init__(self, report, record):
+        self.report = report
+        self.record = record
+    
+    def __getitem__(self, key):
+        if key == 'date':
+            return self.report['date_begin'][:10]
+        if key in ('domain', 'org_name', 'report_id'):
+            return self.report[key]
+        return self.record[key]
+    
+    def keys(self):
+        return self.FIELDS
+    
+    def to_dict(self):
+        return {field: self[field] for field in self.FIELDS}
+
+
+def to_json(value):
+    """json default= hook for DMARCRecord and FailureRecord"""
+    if isinstance(value, (DMARCRecord, FailureRecord)):
+        return value.to_dict()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+# SPF terms that may appear in a pasted/flattened SPF record but do not name a range
+_SPF_TERM_RE = re.compile(r'[-+~?]?(?:(?:v=spf1|all|a|mx|ptr)$|include:|exists:|redirect=|exp=|a[:/]|mx[:/]|ptr:)')
+
+
+def _is_spf_term(token):
+    """True for SPF terms, including ip4:/ip6: and -, ~ or ? qualified ones, so they are never taken as a label"""
+    if token[0] in '-~?' or _SPF_TERM_RE.match(token):
+        return True
+    return token.lstrip('+').startswith(('ip4:', 'ip6:'))
+
+
+def _sender_network(token):
+    """Return the network for a CIDR, bare IP or SPF ip4:/ip6: term, else None"""
+    token = token.lstrip('+')
+    if token.startswith(('ip4:', 'ip6:')):
+        token = token[4:]
+    try:
+        return ipaddress.ip_network(token, strict=False)
+    except ValueError:
+        return None
+
+
+class SenderIndex:
+    """Longest-prefix match of source IPs against labelled authorized sender ranges
+    
+    Networks are kept in one hash table per prefix length and address family,
+    so a lookup costs one probe per distinct prefix length (longest first).
+    Results are memoized since report IPs repeat heavily.
+    
+    The ranges file has one entry per line: an optional label followed by
+    CIDRs, bare IPs or SPF ip4:/ip6: terms. Other SPF terms (v=spf1, include:,
+    ~all, ...) and ranges qualified with -, ~ or ? are ignored, so a flattened
+    SPF record can be pasted after its label. Unlabelled ranges are labelled
+    "authorized".
+    
+        # label   ranges
+        SendGrid  167.89.0.0/17 208.117.48.0/20
+        Google    v=spf1 ip4:35.190.247.0/24 ip6:2001:4860:4000::/36 ~all
+        203.0.113.0/24
+    """
+    
+    def __init__(self, cache_size=1000000):
+        self.tables = {4: {}, 6: {}}  # version -> {prefixlen: {network bits: (label, network)}}
+        self.lengths = {4: [], 6: []}
+        self.count = 0
+        self.cache = {}
+        self.cache_size = cache_size
+    
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path) as f:
+            for line_number, line in enumerate(f, 1):
+                tokens = line.split('#', 1)[0].split()
+                if not tokens:
+                    continue
+                label = 'authorized'
+                if _sender_network(tokens[0]) is None and not _is_spf_term(tokens[0]):
+                    label = tokens.pop(0)
+                for token in tokens:
+                    network = _sender_network(token)
+                    if network is None:
+                        if _SPF_TERM_RE.match(token) or token[0] in '-~?':
+                            continue
+                        raise ValueError(f'{path}:{line_number}: not an IP range: {token}')
+                    index.add(network, label)
+        return index
+    
+    def add(self, network, label):
+        network = ipaddress.ip_network(network, strict=False)
+        host_bits = network.max_prefixlen - network.prefixlen
+        table = self.tables[network.version].setdefault(network.prefixlen, {})
+        table[int(network.network_address) >> host_bits] = (label, str(network))
+        self.lengths[network.version] = sorted(self.tables[network.version], reverse=True)
+        self.count += 1
+        self.cache.clear()
+    
+    def __len__(self):
+        return self.count
+    
+    def lookup(self, ip):
+        """Return (label, network) of the most specific range containing ip, or None"""
+        try:
+            return self.cache[ip]
+        except KeyError:
+            pass
+        
+        match = None
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            address = None
+        if address is not None:
+            if address.version == 6 and address.ipv4_mapped:
+                address = address.ipv4_mapped
+            value, bits = int(address), address.max_prefixlen
+            tables = self.tables[address.version]
+            for prefixlen in self.lengths[address.version]:
+                match = tables[prefixlen].get(value >> (bits - prefixlen))
+                if match is not None:
+                    break
+        
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[ip] = match
+        return match
+    
+    def label(self, ip):
+        match = self.lookup(ip)
+        return match[0] if match else 'unknown'
+
+
+# Recommendation headings in the order they are printed
+RECOMMENDATION_HEADINGS = (
+    "DKIM Failure:",
+    "SPF Failure:",
+    "CRITICAL: Messages are being REJECTED!",
+    "WARNING: Messages are being QUARANTINED (likely spam folder)",
+    "General recommendations:",
+)
+
+
+def recommendations(failure, senders=None):
+    """Return [(heading, lines)] of recommendations for a failure record
+    
+    With a SenderIndex the source IP is checked against the authorized sender
+    ranges and the IP-specific advice says which sender it belongs to.
+    """
+    sections = []
+    source_ip = failure['source_ip']
+    sender = senders.lookup(source_ip) if senders is not None else None
+    
+    if failure['dkim_result'] != 'pass':
+        lines = [
+            "  • Verify DKIM signing is enabled on your mail server",
+            "  • Check DKIM private key configuration",
+            "  • Ensure DKIM DNS record is published correctly",
+            "  • Verify selector and domain match in email headers",
+        ]
+        if sender:
+            lines.append(f"  • Check that the sender in {sender[1]} ({sender[0]}) signs with a DKIM key for your domain")
+        sections.append(("DKIM Failure:", lines))
+    
+    if failure['spf_result'] != 'pass':
+        if senders is None:
+            ip_line = f"  • Add IP {source_ip} to SPF record if legitimate"
+        elif sender:
+            ip_line = f"  • IP {source_ip} is in authorized range {sender[1]} ({sender[0]}): make sure SPF covers it"
+        else:
+            ip_line = f"  • IP {source_ip} is not an authorized sender: add it to SPF only if legitimate"
+        sections.append(("SPF Failure:", [
+            ip_line,
+            "  • Review SPF record for missing authorized servers",
+            "  • Check for SPF record syntax errors",
+            "  • Ensure SPF record is not exceeding DNS lookup limit (10)",
+        ]))
+    
+    if failure['disposition'] == 'reject':
+        sections.append(("CRITICAL: Messages are being REJECTED!", [
+            "  • Immediate action required to prevent email delivery issues",
+        ]))
+    elif failure['disposition'] == 'quarantine':
+        sections.append(("WARNING: Messages are being QUARANTINED (likely spam folder)", []))
+    
+    # IP reputation
+    if sender:
+        ip_lines = [f"  • {source_ip} is in authorized range {sender[1]} ({sender[0]})"]
+    elif senders is not None:
+        ip_lines = [f"  • Check IP reputation for {source_ip}: not in any authorized sender range, possibly spoofed"]
+    else:
+        ip_lines = [f"  • Check IP reputation for {source_ip}",
+                    "  • Verify this IP is authorized to send on your behalf"]
+    sections.append(("General recommendations:", ip_lines + [
+        "  • Use DMARC alignment to ensure domain consistency",
+    ]))
+    return sections
+
+
+class ChunkedWriter:
+    """File-like object that passes text on to a stream in large chunks"""
+    
+    def __init__(self, stream, chunk_size=1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.parts = []
+        self.size = 0
+    
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+        return len(text)
+    
+    def flush(self):
+        if self.parts:
+            self.stream.write(''.join(self.parts))
+            self.parts = []
+            self.size = 0
+        self.stream.flush()
+
+
+@contextlib.contextmanager
+def buffered_stdout(chunk_size=1 << 16):
+    """Buffer print() output instead of writing (and flushing to a terminal) line by line"""
+    writer = ChunkedWriter(sys.stdout, chunk_size)
+    try:
+        with contextlib.redirect_stdout(writer):
+            yield writer
+    finally:
+        writer.flush()
+
+
+def _atomic_write(path, data):
+    """Write text or bytes to path via a temporary file, so readers never see a partial file"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb' if isinstance(data, (bytes, bytearray)) else 'w') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+HISTOGRAM_BUCKETS = {
+    'message_bytes': (1e4, 1e5, 1e6, 1e7, 1e8),
+    'attachment_bytes': (1e3, 1e4, 1e5, 1e6, 1e7, 1e8),
+    'fetch_batch_seconds': (0.1, 0.5, 1, 5, 10, 30, 60),
+    'report_parse_seconds': (0.001, 0.01, 0.1, 1, 10, 60),
+}
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'histogram', 'started')
+    
+    def __init__(self, metrics, stage, histogram):
+        self.metrics = metrics
+        self.stage = stage
+        self.histogram = histogram
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        self.metrics.add_time(self.stage, elapsed)
+        if self.histogram:
+            self.metrics.observe(self.histogram, elapsed)
+
+
+class Metrics:
+    """Per-stage timers, counters, error counts and histograms for one run
+    
+    Stage times are summed over every call, so stages run by several fetch
+    threads or parse processes can add up to more than the wall time. Updates
+    are thread-safe; metrics collected in worker processes or per-mailbox
+    parsers are folded in with merge(to_dict()).
+    """
+    
+    enabled = True
+    
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = defaultdict(lambda: [0, 0.0])  # stage -> [calls, seconds]
+        self.counters = defaultdict(int)
+        self.errors = defaultdict(int)  # (stage, exception type) -> count
+        self.histograms = {name: [0] * (len(buckets) + 1) for name, buckets in HISTOGRAM_BUCKETS.items()}
+        self.sums = defaultdict(float)
+        self.lock = threading.Lock()
+    
+    def child(self):
+        """Empty Metrics for a worker whose results are merged back later"""
+        return Metrics()
+    
+    def time(self, stage, histogram=None):
+        """Context manager adding its duration to `stage` (and observing it in `histogram`)"""
+        return _StageTimer(self, stage, histogram)
+    
+    def add_time(self, stage, seconds, calls=1):
+        with self.lock:
+            totals = self.stages[stage]
+            totals[0] += calls
+            totals[1] += seconds
+    
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+    
+    def error(self, stage, exc):
+        with self.lock:
+            self.errors[stage, type(exc).__name__] += 1
+    
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms[name][bisect.bisect_left(HISTOGRAM_BUCKETS[name], value)] += 1
+            self.sums[name] += value
+    
+    def to_dict(self):
+        with self.lock:
+            return {
+                'elapsed_seconds': round(time.monotonic() - self.started, 3),
+                'stages': {stage: {'calls': calls, 'seconds': round(seconds, 6)}
+                           for stage, (calls, seconds) in self.stages.items()},
+                'counters': dict(self.counters),
+                'errors': [{'stage': stage, 'type': name, 'count': count}
+                           for (stage, name), count in sorted(self.errors.items())],
+                'histograms': {name: {'buckets': list(HISTOGRAM_BUCKETS[name]), 'counts': list(counts),
+                                      'sum': round(self.sums[name], 6)}
+                               for name, counts in self.histograms.items() if any(counts)},
+            }
+    
+    def merge(self, data):
+        """Add metrics from another Metrics.to_dict() (elapsed time is not merged)"""
+        with self.lock:
+            for stage, totals in data['stages'].items():
+                self.stages[stage][0] += totals['calls']
+                self.stages[stage][1] += totals['seconds']
+            for name, value in data['counters'].items():
+                self.counters[name] += value
+            for error in data['errors']:
+                self.errors[error['stage'], error['type']] += error['count']
+            for name, histogram in data['histograms'].items():
+                self.histograms[name] = [a + b for a, b in zip(self.histograms[name], histogram['counts'])]
+                self.sums[name] += histogram['sum']
+    
+    def print_summary(self):
+        data = self.to_dict()
+        print(f"\n{Colors.BOLD}RUN METRICS ({data['elapsed_seconds']:.2f}s):{Colors.END}")
+        for stage, totals in sorted(data['stages'].items(), key=lambda item: -item[1]['seconds']):
+            print(f"  {stage:<12} {totals['seconds']:>10.3f}s  {totals['calls']:>8} calls")
+        counters = data['counters']
+        if counters:
+            print('  ' + ', '.join(f'{name}: {value}' for name, value in sorted(counters.items())))
+        for name, histogram in data['histograms'].items():
+            count = sum(histogram['counts'])
+            print(f"  {name}: {count} observed, mean {histogram['sum'] / count:.4g}")
+        for error in data['errors']:
+            print(f"  {Colors.YELLOW}{error['count']} {error['type']} errors during {error['stage']}{Colors.END}")
+    
+    def save_json(self, path):
+        _atomic_write(path, json.dumps({'generated_at': datetime.now().isoformat(), **self.to_dict()}, indent=2))
+    
+    def save_prometheus(self, path):
+        """Write the metrics in the Prometheus text format, for node_exporter's textfile collector
+        
+        The file is replaced atomically so the collector never reads a partial file.
+        """
+        data = self.to_dict()
+        lines = [
+            '# HELP dmarc_run_duration_seconds Wall time of the run so far.',
+            '# TYPE dmarc_run_duration_seconds gauge',
+            f"dmarc_run_duration_seconds {data['elapsed_seconds']}",
+            '# HELP dmarc_last_run_timestamp_seconds Time these metrics were written.',
+            '# TYPE dmarc_last_run_timestamp_seconds gauge',
+            f'dmarc_last_run_timestamp_seconds {time.time():.0f}',
+            '# HELP dmarc_stage_seconds_total Time spent per stage, summed over threads and processes.',
+            '# TYPE dmarc_stage_seconds_total counter',
+        ]
+        lines += [f'dmarc_stage_seconds_total{{stage="{stage}"}} {totals["seconds"]}'
+                  for stage, totals in sorted(data['stages'].items())]
+        lines += ['# HELP dmarc_stage_calls_total Calls per stage.', '# TYPE dmarc_stage_calls_total counter']
+        lines += [f'dmarc_stage_calls_total{{stage="{stage}"}} {totals["calls"]}'
+                  for stage, totals in sorted(data['stages'].items())]
+        for name, value in sorted(data['counters'].items()):
+            lines += [f'# TYPE dmarc_{name}_total counter', f'dmarc_{name}_total {value}']
+        lines += ['# HELP dmarc_errors_total Errors by stage and exception type.', '# TYPE dmarc_errors_total counter']
+        lines += [f'dmarc_errors_total{{stage="{error["stage"]}",type="{error["type"]}"}} {error["count"]}'
+                  for error in data['errors']]
+        for name, histogram in sorted(data['histograms'].items()):
+            lines.append(f'# TYPE dmarc_{name} histogram')
+            cumulative = 0
+            for bound, count in zip([f'{bound:g}' for bound in histogram['buckets']] + ['+Inf'],
+                                    histogram['counts']):
+                cumulative += count
+                lines.append(f'dmarc_{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f'dmarc_{name}_sum {histogram["sum"]}', f'dmarc_{name}_count {cumulative}']
+        _atomic_write(path, '\n'.join(lines) + '\n')
+
+
+class NullMetrics:
+    """Stand-in for Metrics when instrumentation is off: every call is a no-op"""
+    
+    enabled = False
+    _timer = contextlib.nullcontext()
+    
+    def child(self):
+        return self
+    
+    def time(self, stage, histogram=None):
+        return self._timer
+    
+    def add_time(self, stage, seconds, calls=1):
+        pass
+    
+    def inc(self, name, value=1):
+        pass
+    
+    def error(self, stage, exc):
+        pass
+    
+    def observe(self, name, value):
+        pass
+    
+    def merge(self, data):
+        pass
+
+
+class SyncState:
+    """Persistent per-account/per-mailbox UID checkpoints for incremental runs"""
+    
+    def __init__(self, path='dmarc_state.json'):
+        self.path = path
+        self.checkpoints = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.checkpoints = json.load(f)
+    
+    @staticmethod
+    def key(email_address, imap_server, mailbox):
+        return f'{email_address}|{imap_server}|{mailbox}'
+    
+    def get(self, email_address, imap_server, mailbox):
+        """Return the stored {'uidvalidity', 'last_uid'} checkpoint, if any"""
+        return self.checkpoints.get(self.key(email_address, imap_server, mailbox))
+    
+    def update(self, email_address, imap_server, mailbox, uidvalidity, last_uid):
+        self.checkpoints[self.key(email_address, imap_server, mailbox)] = {
+            'uidvalidity': uidvalidity,
+            'last_uid': last_uid,
+            'updated_at': datetime.now().isoformat(),
+        }
+    
+    def save(self):
+        """Write the state file atomically so an interrupted run can't corrupt it"""
+        if self.path is None:
+            return
+        _atomic_write(self.path, json.dumps(self.checkpoints, indent=2))
+
+
+class FailureRollup:
+    """Failed message counts aggregated as records are parsed
+    
+    Totals are keyed by (domain, source_ip, org_name, day, dkim_result,
+    spf_result, disposition), so per-sender, per-reporter and per-day
+    questions are answered from a few thousand keys instead of every record.
+    Rollups from separate runs can be merged; reports already counted (by
+    org_name/report_id) are skipped when a rollup is persisted across runs
+    with load()/save().
+    """
+    
+    KEY_FIELDS = ('domain', 'source_ip', 'org_name', 'day', 'dkim_result', 'spf_result', 'disposition')
+    
+    def __init__(self, path=None):
+        self.path = path
+        self.totals = defaultdict(lambda: [0, 0])  # key -> [messages, records]
+        self.report_ids = set()
+        self.current = None
+        self.skip_current = False
+    
+    @classmethod
+    def load(cls, path):
+        rollup = cls(path)
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            rollup.report_ids = {tuple(report) for report in data['reports']}
+            for row in data['totals']:
+                rollup.totals[tuple(row[:-2])] = row[-2:]
+        return rollup
+    
+    def save(self, path=None):
+        """Write the rollup atomically, like SyncState.save()"""
+        path = path or self.path
+        _atomic_write(path, json.dumps({
+            'reports': sorted(self.report_ids),
+            'totals': [list(key) + totals for key, totals in sorted(self.totals.items())],
+        }, separators=(',', ':')))
+    
+    def add(self, report_info, record_data):
+        """Count a record if it is a failure; records of already-counted reports are ignored"""
+        if report_info is not self.current:
+            self.current = report_info
+            report_key = (report_info['org_name'], report_info['report_id'])
+            self.skip_current = report_key in self.report_ids
+            self.report_ids.add(report_key)
+        if self.skip_current or not record_data['has_failure']:
+            return
+        totals = self.totals[(report_info['domain'], record_data['source_ip'], report_info['org_name'],
+                              report_info['date_begin'][:10], record_data['dkim_result'],
+                              record_data['spf_result'], record_data['disposition'])]
+        totals[0] += record_data['count']
+        totals[1] += 1
+    
+    def merge(self, other):
+        """Add another rollup's totals; the two must not share reports"""
+        overlap = self.report_ids & other.report_ids
+        if overlap:
+            raise ValueError(f'{len(overlap)} reports are already included in this rollup')
+        self.report_ids |= other.report_ids
+        for key, (messages, records) in other.totals.items():
+            totals = self.totals[key]
+            totals[0] += messages
+            totals[1] += records
+    
+    def select(self, domain=None, since=None, until=None):
+        """Yield (key, messages, records), optionally filtered by domain and YYYY-MM-DD day range"""
+        for key, (messages, records) in self.totals.items():
+            if domain and key[0] != domain:
+                continue
+            if (since and key[3] < since) or (until and key[3] > until):
+                continue
+            yield key, messages, records
+    
+    def group(self, fields, domain=None, since=None, until=None):
+        """Return {values of fields: failed messages}"""
+        indexes = [self.KEY_FIELDS.index(field) for field in fields]
+        groups = defaultdict(int)
+        for key, messages, _ in self.select(domain, since, until):
+            groups[tuple(key[i] for i in indexes)] += messages
+        return groups
+    
+    def top(self, field='source_ip', n=10, domain=None, since=None, until=None):
+        """Return the n (value, failed messages) pairs with the most failures"""
+        groups = self.group((field,), domain, since, until)
+        return [(value[0], messages) for value, messages in
+                sorted(groups.items(), key=lambda item: (-item[1], item[0]))[:n]]
+    
+    def time_series(self, domain=None, since=None, until=None, source_ip=None):
+        """Return [(day, failed messages)] in date order, optionally for one source IP"""
+        days = defaultdict(int)
+        for key, messages, _ in self.select(domain, since, until):
+            if source_ip is None or key[1] == source_ip:
+                days[key[3]] += messages
+        return sorted(days.items())
+    
+    def print_summary(self, n=10, domain=None, since=None, until=None):
+        """Print the top failing senders and reporters and failures per day"""
+        print(f"\n{Colors.BOLD}{Colors.CYAN}FAILURE ROLLUP{Colors.END} ({len(self.report_ids)} reports)")
+        for title, field in (('Top failing source IPs', 'source_ip'), ('Top reporters', 'org_name')):
+            print(f"\n{Colors.BOLD}{title}:{Colors.END}")
+            for value, messages in self.top(field, n, domain, since, until):
+                print(f"  {value:<40} {messages:>10} messages")
+        print(f"\n{Colors.BOLD}Failed messages per day:{Colors.END}")
+        for day, messages in self.time_series(domain, since, until):
+            print(f"  {day}  {messages:>10}")
+
+
+class AnomalyDetector:
+    """Flags first-seen failing senders and spikes in failed messages per domain
+    
+    The baseline is updated as records are parsed and persisted with
+    load()/save(), so history is never rescanned: per domain, the set of
+    source IPs that have failed before and the failed message count of each
+    day with reports in the last `window` days. A failing record from an IP
+    outside its domain's set is a new sender, except while a domain has no
+    earlier days (its first reports only seed the baseline). After parsing,
+    detect_spikes() flags days whose failed messages reach min_messages and
+    exceed factor times the median of the domain's previous days. A detector
+    that is seeding (the first run, before the baseline file exists) only
+    builds the baseline, so a multi-day backfill flags nothing.
+    
+    Reports already counted (by org_name/report_id), like in FailureRollup,
+    and reports older than the stored window are skipped.
+    """
+    
+    def __init__(self, path=None, window=14, factor=3.0, min_messages=20, min_days=3, seeding=False):
+        self.path = path
+        self.seeding = seeding
+        self.window = window
+        self.factor = factor
+        self.min_messages = min_messages
+        self.min_days = min_days
+        self.sources = defaultdict(set)  # domain -> source IPs that have failed
+        self.days = defaultdict(lambda: defaultdict(int))  # domain -> day -> failed messages
+        self.report_ids = {}  # (org_name, report_id) -> day
+        self.alerted = set()  # (domain, day) spikes already flagged
+        self.cutoff = ''
+        self.anomalies = []
+        self.touched = set()
+        self.current = None
+        self.skip_current = False
+        self.learning = False
+    
+    @classmethod
+    def load(cls, path, window=14, factor=3.0, min_messages=20):
+        detector = cls(path, window, factor, min_messages, seeding=not os.path.exists(path))
+        if not detector.seeding:
+            with open(path) as f:
+                data = json.load(f)
+            for domain, sources in data['sources'].items():
+                detector.sources[domain] = set(sources)
+            for domain, days in data['days'].items():
+                detector.days[domain].update(days)
+            detector.report_ids = {(org_name, report_id): day for org_name, report_id, day in data['reports']}
+            detector.alerted = {tuple(spike) for spike in data['alerted']}
+            detector.cutoff = detector.window_start()
+        return detector
+    
+    def window_start(self):
+        """First day kept in the baseline: `window` days before the newest day seen"""
+        newest = max((max(days) for days in self.days.values() if days), default=None)
+        if newest is None:
+            return ''
+        return (datetime.strptime(newest, '%Y-%m-%d') - timedelta(days=self.window)).strftime('%Y-%m-%d')
+    
+    def save(self, path=None):
+        """Prune days outside the window and write the baseline atomically, like SyncState.save()"""
+        path = path or self.path
+        cutoff = self.window_start()
+        for days in self.days.values():
+            for day in [day for day in days if day < cutoff]:
+                del days[day]
+        self.report_ids = {key: day for key, day in self.report_ids.items() if day >= cutoff}
+        self.alerted = {spike for spike in self.alerted if spike[1] >= cutoff}
+        _atomic_write(path, json.dumps({
+            'sources': {domain: sorted(sources) for domain, sources in sorted(self.sources.items())},
+            'days': {domain: dict(sorted(days.items())) for domain, days in sorted(self.days.items())},
+            'reports': sorted(key + (day,) for key, day in self.report_ids.items()),
+            'alerted': sorted(self.alerted),
+        }, separators=(',', ':')))
+    
+    def add(self, report_info, record_data):
+        """Update the baseline with a record, flagging it if its failing source IP is new"""
+        if report_info is not self.current:
+            self.current = report_info
+            day = report_info['date_begin'][:10]
+            report_key = (report_info['org_name'], report_info['report_id'])
+            self.skip_current = report_key in self.report_ids or day < self.cutoff
+            if not self.skip_current:
+                self.report_ids[report_key] = day
+                days = self.days[report_info['domain']]
+                self.learning = not any(earlier < day for earlier in days)
+                days[day] += 0  # Days without failures count towards the baseline too
+                self.touched.add((report_info['domain'], day))
+        if self.skip_current or not record_data['has_failure']:
+            return
+        domain = report_info['domain']
+        day = report_info['date_begin'][:10]
+        self.days[domain][day] += record_data['count']
+        source_ip = record_data['source_ip']
+        sources = self.sources[domain]
+        if source_ip not in sources:
+            sources.add(source_ip)
+            if not (self.learning or self.seeding):
+                self.anomalies.append({
+                    'type': 'new_sender',
+                    'domain': domain,
+                    'day': day,
+                    'source_ip': source_ip,
+                    'org_name': report_info['org_name'],
+                    'count': record_data['count'],
+                    'dkim_result': record_data['dkim_result'],
+                    'spf_result': record_data['spf_result'],
+                    'disposition': record_data['disposition'],
+                })
+    
+    def detect_spikes(self):
+        """Flag spikes on the days updated since the last call; returns the new spike anomalies"""
+        spikes = []
+        if self.seeding:
+            self.touched = set()
+            return spikes
+        for domain, day in sorted(self.touched):
+            days = self.days[domain]
+            history = [days[earlier] for earlier in sorted(days) if earlier < day][-self.window:]
+            if len(history) < self.min_days or (domain, day) in self.alerted:
+                continue
+            baseline = statistics.median(history)
+            if days[day] >= self.min_messages and days[day] > self.factor * baseline:
+                self.alerted.add((domain, day))
+                spikes.append({'type': 'spike', 'domain': domain, 'day': day, 'count': days[day],
+                               'baseline': baseline})
+        self.touched = set()
+        self.anomalies.extend(spikes)
+        return spikes
+    
+    def print_summary(self, n=10, senders=None):
+        """Print spikes and the n largest new failing senders per domain"""
+        if self.seeding:
+            days = sum(len(days) for days in self.days.values())
+            print(f"\n{Colors.BLUE}Seeded the anomaly baseline with {days} domain-days; new senders and spikes "
+                  f"are flagged from the next run{Colors.END}")
+            return
+        if not self.anomalies:
+            print(f"\n{Colors.GREEN}No new failing senders or failure spikes{Colors.END}")
+            return
+        print(f"\n{Colors.BOLD}{Colors.RED}ANOMALIES{Colors.END}")
+        for spike in (anomaly for anomaly in self.anomalies if anomaly['type'] == 'spike'):
+            print(f"  {Colors.RED}Spike{Colors.END} {spike['domain']} on {spike['day']}: {spike['count']} failed "
+                  f"messages (baseline {spike['baseline']:g}/day)")
+        new_senders = defaultdict(list)
+        for anomaly in self.anomalies:
+            if anomaly['type'] == 'new_sender':
+                new_senders[anomaly['domain']].append(anomaly)
+        for domain, anomalies in new_senders.items():
+            print(f"\n  {Colors.BOLD}New failing senders for {domain}:{Colors.END} {len(anomalies)}")
+            for anomaly in sorted(anomalies, key=lambda a: (-a['count'], a['source_ip']))[:n]:
+                sender = f"  {senders.label(anomaly['source_ip'])}" if senders is not None else ''
+                print(f"  {anomaly['source_ip']:<40} {anomaly['count']:>8} messages  {anomaly['day']}  "
+                      f"DKIM {anomaly['dkim_result']}, SPF {anomaly['spf_result']}{sender}")
+            if len(anomalies) > n:
+                print(f"  ... and {len(anomalies) - n} more")
+
+
+class ReportStore:
+    """Persistent SQLite store of parsed reports and records
+    
+    Reports are deduplicated on (org_name, report_id), so re-delivered reports
+    are only counted once. Rows are written with executemany() and committed in
+    bulk; each report is wrapped in a savepoint so a report that fails halfway
+    through parsing leaves nothing behind.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY,
+            org_name TEXT NOT NULL,
+            report_id TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            date_begin TEXT NOT NULL,
+            date_end TEXT NOT NULL,
+            dmarc_policy TEXT,
+            filename TEXT,
+            UNIQUE (org_name, report_id)
+        );
+        CREATE TABLE IF NOT EXISTS records (
+            report INTEGER NOT NULL REFERENCES reports (id),
+            source_ip TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            disposition TEXT,
+            dkim_result TEXT,
+            spf_result TEXT,
+            dkim_details TEXT,
+            spf_details TEXT,
+            header_from TEXT,
+            has_failure INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS reports_domain_date ON reports (domain, date_begin);
+        CREATE INDEX IF NOT EXISTS reports_date ON reports (date_begin);
+        CREATE INDEX IF NOT EXISTS records_report ON records (report);
+        CREATE INDEX IF NOT EXISTS records_source_ip ON records (source_ip);
+        CREATE INDEX IF NOT EXISTS records_result ON records (has_failure, dkim_result, spf_result);
+    """
+    
+    def __init__(self, path='dmarc_reports.db', commit_every=100, insert_batch=5000):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+        self.commit_every = commit_every
+        self.insert_batch = insert_batch
+        self.current = None
+        self.current_pk = None
+        self.rows = []
+        self.pending_reports = 0
+        self.stored = 0
+        self.duplicates = 0
+    
+    def begin_report(self, report_info):
+        if self.current is not None:
+            # The previous report never finished; drop its partial rows
+            self.conn.execute('ROLLBACK TO report')
+            self.conn.execute('RELEASE report')
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN')
+        self.conn.execute('SAVEPOINT report')
+        self.current = report_info
+        self.rows = []
+        cursor = self.conn.execute(
+            'INSERT OR IGNORE INTO reports (org_name, report_id, domain, date_begin, date_end, dmarc_policy, filename) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (report_info['org_name'], report_info['report_id'], report_info['domain'],
+             report_info['date_begin'], report_info['date_end'], report_info['dmarc_policy'],
+             report_info['filename']))
+        self.current_pk = cursor.lastrowid if cursor.rowcount else None
+    
+    def add_record(self, report_info, record_data):
+        if report_info is not self.current:
+            self.begin_report(report_info)
+        if self.current_pk is None:
+            return
+        self.rows.append((
+            self.current_pk, record_data['source_ip'], record_data['count'], record_data['disposition'],
+            record_data['dkim_result'], record_data['spf_result'], json.dumps(record_data['dkim_details']),
+            json.dumps(record_data['spf_details']), record_data['header_from'], int(record_data['has_failure']),
+        ))
+        if len(self.rows) >= self.insert_batch:
+            self.flush_rows()
+    
+    def flush_rows(self):
+        if self.rows:
+            self.conn.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.rows)
+            self.rows = []
+    
+    def finish_report(self, report_info):
+        if report_info is not self.current:
+            self.begin_report(report_info)
+        self.flush_rows()
+        self.conn.execute('RELEASE report')
+        if self.current_pk is None:
+            self.duplicates += 1
+        else:
+            self.stored += 1
+        self.current = self.current_pk = None
+        self.pending_reports += 1
+        if self.pending_reports >= self.commit_every:
+            self.commit()
+    
+    def commit(self):
+        if self.current is None and self.conn.in_transaction:
+            self.conn.execute('COMMIT')
+            self.pending_reports = 0
+    
+    def close(self):
+        if self.current is not None:
+            self.conn.execute('ROLLBACK TO report')
+            self.conn.execute('RELEASE report')
+            self.current = None
+        self.commit()
+        self.conn.close()
+    
+    def _filters(self, domain=None, since=None, until=None):
+        clauses, params = [], []
+        if domain:
+            clauses.append('r.domain = ?')
+            params.append(domain)
+        if since:
+            clauses.append('r.date_begin >= ?')
+            params.append(since)
+        if until:
+            clauses.append("r.date_begin < date(?, '+1 day')")
+            params.append(until)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+    
+    def iter_reports(self, domain=None, since=None, until=None):
+        """Yield (report_info, records) in date order, optionally filtered
+        
+        since/until are inclusive YYYY-MM-DD dates matched against date_begin.
+        """
+        where, params = self._filters(domain, since, until)
+        rows = self.conn.execute(
+            'SELECT r.id, r.filename, r.org_name, r.report_id, r.domain, r.date_begin, r.date_end, r.dmarc_policy, '
+            'c.source_ip, c.count, c.disposition, c.dkim_result, c.spf_result, c.dkim_details, c.spf_details, '
+            'c.header_from, c.has_failure '
+            f'FROM reports r LEFT JOIN records c ON c.report = r.id{where} '
+            'ORDER BY r.date_begin, r.id, c.rowid', params)
+        
+        current_id, report_info, records = None, None, []
+        for row in rows:
+            if row[0] != current_id:
+                if report_info is not None:
+                    yield report_info, records
+                current_id = row[0]
+                report_info = dict(zip(('filename', 'org_name', 'report_id', 'domain', 'date_begin', 'date_end',
+                                        'dmarc_policy'), row[1:8]))
+                report_info['records'] = []
+                records = []
+            if row[8] is not None:
+                records.append(DMARCRecord(
+                    row[8], row[9], row[10], row[11], row[12],
+                    [(detail['domain'], detail['result']) for detail in json.loads(row[13])],
+                    [(detail['domain'], detail['result']) for detail in json.loads(row[14])],
+                    row[15],
+                ))
+        if report_info is not None:
+            yield report_info, records
+
+
+class AttachmentCache:
+    """Content-addressed on-disk cache of raw report attachments
+    
+    Each distinct attachment is stored once under its SHA-256 digest (gzip
+    compressed unless it already is), with an SQLite index mapping emails
+    (account/mailbox/UIDVALIDITY/UID key and Message-ID) to their attachments.
+    When the cache grows past max_bytes the least recently used attachments
+    are evicted until it is back under low_water (90%) of max_bytes, so
+    eviction runs once per batch of new attachments rather than on every put.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blobs (
+            digest TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            compressed INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS attachments (
+            id INTEGER PRIMARY KEY,
+            message_key TEXT,
+            message_id TEXT,
+            digest TEXT NOT NULL REFERENCES blobs (digest),
+            filename TEXT NOT NULL,
+            from_addr TEXT,
+            subject TEXT,
+            UNIQUE (message_key, digest)
+        );
+        CREATE INDEX IF NOT EXISTS attachments_message ON attachments (message_key);
+        CREATE INDEX IF NOT EXISTS attachments_digest ON attachments (digest);
+        CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+    """
+    
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, commit_every=100, low_water=0.9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.commit_every = commit_every
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, 'index.db'))
+        self.conn.executescript(self.SCHEMA)
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        self.pending = 0
+    
+    def blob_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+    
+    def put(self, file_data, filename, from_addr='', subject='', message_key=None, message_id=None):
+        """Store an attachment (if new) and its email mapping; returns its digest"""
+        digest = hashlib.sha256(file_data).hexdigest()
+        now = time.time()
+        if self.conn.execute('UPDATE blobs SET last_used = ? WHERE digest = ?', (now, digest)).rowcount == 0:
+            compressed = not filename.endswith(('.gz', '.zip'))
+            payload = gzip.compress(file_data, compresslevel=6) if compressed else file_data
+            path = self.blob_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _atomic_write(path, payload)
+            self.conn.execute('INSERT INTO blobs VALUES (?, ?, ?, ?)', (digest, len(payload), int(compressed), now))
+            self.total_bytes += len(payload)
+        self.conn.execute(
+            'INSERT OR IGNORE INTO attachments (message_key, message_id, digest, filename, from_addr, subject) '
+            'VALUES (?, ?, ?, ?, ?, ?)', (message_key, message_id, digest, filename, from_addr, subject))
+        if self.total_bytes > self.max_bytes:
+            self.evict(keep=digest)
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+        return digest
+    
+    def get(self, digest):
+        """Return the raw attachment bytes for a digest, or None if evicted or missing on disk"""
+        row = self.conn.execute('SELECT compressed, size FROM blobs WHERE digest = ?', (digest,)).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self.blob_path(digest), 'rb') as f:
+                payload = f.read()
+        except FileNotFoundError:
+            # Deleted outside the cache: forget it so the email is fetched again
+            self.forget([digest])
+            self.total_bytes -= row[1]
+            return None
+        self.conn.execute('UPDATE blobs SET last_used = ? WHERE digest = ?', (time.time(), digest))
+        return gzip.decompress(payload) if row[0] else payload
+    
+    def forget(self, digests):
+        """Delete the index rows of attachments"""
+        params = [(digest,) for digest in digests]
+        self.conn.executemany('DELETE FROM attachments WHERE digest = ?', params)
+        self.conn.executemany('DELETE FROM blobs WHERE digest = ?', params)
+    
+    def lookup(self, message_key):
+        """Return (digest, filename, from_addr, subject) for a cached email"""
+        return self.conn.execute(
+            'SELECT digest, filename, from_addr, subject FROM attachments WHERE message_key = ? ORDER BY id',
+            (message_key,)).fetchall()
+    
+    def iter_attachments(self):
+        """Yield (digest, filename, from_addr, subject) once per distinct attachment, oldest first"""
+        rows = self.conn.execute(
+            'SELECT digest, filename, from_addr, subject FROM attachments '
+            'WHERE id IN (SELECT MIN(id) FROM attachments GROUP BY digest) ORDER BY id').fetchall()
+        yield from rows
+    
+    def evict(self, keep=None):
+        """Delete least recently used attachments until the cache fits low_water of max_bytes
+        
+        Only the oldest rows are read, and the index deletions are committed
+        before the files are removed, so the index never points at a deleted file.
+        """
+        target = self.max_bytes * self.low_water
+        victims = []
+        for digest, size in self.conn.execute('SELECT digest, size FROM blobs ORDER BY last_used'):
+            if self.total_bytes <= target:
+                break
+            if digest != keep:
+                victims.append(digest)
+                self.total_bytes -= size
+        self.forget(victims)
+        self.commit()
+        for digest in victims:
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+    
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+    
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class NDJSONExporter:
+    """Write results as newline-delimited JSON while reports are being parsed
+    
+    Every record becomes a {"type": "record", ...} line shaped like an entry of
+    the JSON failures list, followed by a {"type": "report", ...} line with the
+    report metadata and its record_count once the report is complete. Paths
+    ending in .gz are gzip compressed.
+    """
+    
+    def __init__(self, path, compress=None):
+        self.path = path
+        if compress is None:
+            compress = path.endswith('.gz')
+        if compress:
+            self.file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+        self.reports = 0
+        self.records = 0
+        self.report_records = 0
+    
+    def write(self, line):
+        self.file.write(json.dumps(line, separators=(',', ':'), default=to_json))
+        self.file.write('\n')
+    
+    def add_record(self, report_info, record_data):
+        self.write({'type': 'record', **FailureRecord(report_info, record_data).to_dict()})
+        self.records += 1
+        self.report_records += 1
+    
+    def finish_report(self, report_info):
+        line = {'type': 'report'}
+        line.update((key, value) for key, value in report_info.items() if key not in ('records', 'record_count'))
+        line['record_count'] = self.report_records
+        self.write(line)
+        self.reports += 1
+        self.report_records = 0
+    
+    def flush(self):
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+
+
+class IMAPConnectionPool:
+    """Reusable authenticated IMAP connections for concurrent fetch workers"""
+    
+    def __init__(self, connect, size):
+        self.connect = connect
+        self.size = size
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.LifoQueue()
+        self.selected = {}
+    
+    def acquire(self, mailbox):
+        """Borrow a connection with mailbox selected, opening one if none is idle"""
+        self.slots.acquire()
+        try:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+            if self.selected.get(id(conn)) != mailbox:
+                conn.select(mailbox)
+                self.selected[id(conn)] = mailbox
+            return conn
+        except Exception:
+            self.slots.release()
+            raise
+    
+    def release(self, conn):
+        """Return a healthy connection to the pool"""
+        self.idle.put(conn)
+        self.slots.release()
+    
+    def discard(self, conn):
+        """Drop a connection after a transient error"""
+        self.selected.pop(id(conn), None)
+        try:
+            conn.logout()
+        except Exception:
+            pass
+        self.slots.release()
+    
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.selected.pop(id(conn), None)
+            try:
+                conn.close()
+                conn.logout()
+            except Exception:
+                pass
+
+
+class ParsePool:
+    """Parses report attachments in worker processes
+    
+    Results are merged into the owning parser in submission order, so the
+    outcome is the same as parsing serially. At most max_pending attachments
+    are in flight at once. With --stream, workers hand records back in
+    bounded chunks over a per-attachment queue instead of returning whole
+    reports, so neither process holds a full report in memory.
+    
+    The pool is usually started while download threads are running, so
+    workers come from a forkserver (or are spawned) rather than forked from
+    this process, where another thread may be holding an ssl/imaplib or
+    stdout lock.
+    """
+    
+    def __init__(self, parser, workers, max_pending=None):
+        self.parser = parser
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        context = multiprocessing.get_context(start_method)
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        self.manager = context.Manager() if parser.stream else None
+        self.pending = deque()
+        self.max_pending = max_pending or workers * 4
+    
+    def submit(self, file_data, filename, from_addr, subject):
+        chunks = self.manager.Queue(PARSE_CHUNKS_QUEUED) if self.manager is not None else None
+        future = self.executor.submit(parse_attachment, file_data, filename, from_addr, subject, self.parser.stream,
+                                      self.parser.metrics.enabled, chunks)
+        self.pending.append((filename, future, chunks))
+        while len(self.pending) > self.max_pending:
+            self.merge_next()
+    
+    def merge_next(self):
+        filename, future, chunks = self.pending.popleft()
+        report = None
+        try:
+            while chunks is not None:
+                try:
+                    report = self.parser.merge_parsed(chunks.get(timeout=0.1), report)
+                except queue.Empty:
+                    # Chunks are queued before the worker returns, so none can follow once it is done
+                    if future.done() and chunks.empty():
+                        break
+            events = future.result()
+        except Exception as e:
+            self.parser.metrics.error('parse', e)
+            print(f"{Colors.YELLOW}Warning: Could not parse {filename}: {str(e)}{Colors.END}")
+            return
+        self.parser.merge_parsed(events, report)
+    
+    def drain(self):
+        while self.pending:
+            self.merge_next()
+    
+    def shutdown(self):
+        self.drain()
+        self.executor.shutdown()
+        if self.manager is not None:
+            self.manager.shutdown()
+
+
 class DMARCParser:
-    def __init__(self, email_address, password, imap_server='imap.gmail.com', verbose=False):
+    def __init__(self, email_address, password, imap_server='imap.gmail.com', verbose=False, stream=False,
+                 parse_workers=1, store=None, cache=None, exporter=None, port=None, use_ssl=True):
         self.email_address = email_address
         self.password = password
         self.imap_server = imap_server
+        self.port = port
+        self.use_ssl = use_ssl
+        self.mail = None
         self.reports = []
         self.failures = []
         self.verbose = verbose
+        self.stream = stream
+        self.parse_workers = parse_workers
+        self.parse_pool = None
+        self.store = store
+        self.cache = cache
+        self.exporter = exporter
+        self.rollup = None
+        self.senders = None
+        self.detector = None
+        self.metrics = NullMetrics()
+        self.parsed_digests = set()
+        self.mailbox = None
+        self.uidvalidity = None
+        self.bytes_downloaded = 0
+        self._counter_lock = threading.Lock()
         
+    def open_connection(self):
+        """Open and authenticate a new IMAP connection"""
+        with self.metrics.time('connect'):
+            if self.use_ssl:
+                mail = imaplib.IMAP4_SSL(self.imap_server, self.port or imaplib.IMAP4_SSL_PORT)
+            else:
+                mail = imaplib.IMAP4(self.imap_server, self.port or imaplib.IMAP4_PORT)
+            mail.login(self.email_address, self.password)
+        return mail
+    
     def connect(self):
         """Connect to Gmail IMAP server"""
         try:
             print(f"{Colors.CYAN}Connecting to {self.imap_server}...{Colors.END}")
-            self.mail = imaplib.IMAP4_SSL(self.imap_server)
-            self.mail.login(self.email_address, self.password)
+            self.mail = self.open_connection()
             print(f"{Colors.GREEN}✓ Connected successfully{Colors.END}\n")
             return True
         except Exception as e:
             print(f"{Colors.RED}✗ Connection failed: {str(e)}{Colors.END}")
             return False
     
-    def fetch_dmarc_reports(self, mailbox='INBOX', limit=50):
-        """Fetch DMARC report emails"""
+    def fetch_dmarc_reports(self, mailbox='INBOX', limit=50, batch_size=FETCH_BATCH_SIZE, state=None,
+                            attachments_only=False, workers=1):
+        """Fetch DMARC report emails
+        
+        With a SyncState, only messages newer than the stored checkpoint for this
+        account/mailbox are fetched, and the checkpoint advances after each batch.
+        A changed UIDVALIDITY invalidates the checkpoint and forces a full resync.
+        
+        With attachments_only, messages are screened on ENVELOPE/BODYSTRUCTURE and
+        only report attachment sections are downloaded (without setting \\Seen).
+        
+        With workers > 1, batches are downloaded over that many extra connections
+        while this thread parses completed batches in UID order.
+        
+        Returns the number of emails selected (at most limit), or None on error.
+        """
         try:
             self.mail.select(mailbox)
+            self.mailbox = mailbox
+            if state is not None or self.cache is not None:
+                uidvalidity = self.uidvalidity = self.get_uidvalidity(mailbox)
             
-            # Search for DMARC reports with multiple criteria
-            # Standard DMARC report subject format: "Report Domain: example.com Submitter: reporter.com"
-            search_criteria = [
-                'SUBJECT "Report Domain:"',  # Standard DMARC report format
-                'FROM "dmarc"',               # From addresses containing dmarc
-                'SUBJECT "dmarc"',            # Subject containing dmarc
-                'FROM "noreply@google.com"',  # Google DMARC reports
-                'FROM "yahoo"',               # Yahoo DMARC reports
-                'FROM "postmaster"',          # Generic postmaster reports
-            ]
-            
-            email_ids = []
-            for criteria in search_criteria:
-                status, messages = self.mail.search(None, criteria)
-                if status == 'OK' and messages[0]:
-                    found = messages[0].split()
-                    email_ids.extend(found)
-                    if self.verbose and found:
-                        print(f"{Colors.CYAN}  Criteria '{criteria}': found {len(found)} emails{Colors.END}")
+            since_uid = 0
+            if state is not None:
+                checkpoint = state.get(self.email_address, self.imap_server, mailbox)
+                if checkpoint and checkpoint['uidvalidity'] == uidvalidity:
+                    since_uid = checkpoint['last_uid']
+                    print(f"{Colors.CYAN}Incremental sync: fetching emails after UID {since_uid}{Colors.END}")
+                elif checkpoint:
+                    print(f"{Colors.YELLOW}UIDVALIDITY of {mailbox} changed, performing full resync{Colors.END}")
+                state.update(self.email_address, self.imap_server, mailbox, uidvalidity, since_uid)
             
-            # Remove duplicates and limit
-            unique_ids = list(set(email_ids))
-            email_ids = unique_ids[-limit:]
+            uids = self.search_dmarc_uids(since_uid=since_uid)
+            if state is not None:
+                # Oldest first (also on the first run or after a UIDVALIDITY change),
+                # so the checkpoint never skips past unprocessed emails
+                email_ids = uids[:limit] if limit else uids
+            else:
+                # UIDs are sorted ascending, so this keeps the most recent messages
+                email_ids = uids[-limit:]
             
             if self.verbose:
-                print(f"{Colors.CYAN}Total unique emails: {len(unique_ids)}, processing last {len(email_ids)}{Colors.END}")
+                print(f"{Colors.CYAN}Total unique emails: {len(uids)}, processing {len(email_ids)}{Colors.END}")
             
             print(f"{Colors.BLUE}Found {len(email_ids)} potential DMARC report emails{Colors.END}\n")
             
-            for email_id in email_ids:
-                self.process_email(email_id)
+            started = time.monotonic()
+            self.bytes_downloaded = 0
+            processed = 0
+            to_fetch = email_ids
+            if self.cache is not None:
+                # Emails whose attachments are already cached are parsed from disk
+                to_fetch = []
+                for uid in email_ids:
+                    if self.replay_cached_email(uid):
+                        processed += 1
+                    else:
+                        to_fetch.append(uid)
+            
+            for batch, results in self.iter_fetched_batches(mailbox, to_fetch, batch_size,
+                                                            attachments_only, workers):
+                for result in results:
+                    if attachments_only:
+                        uid, subject, from_addr, attachments, message_id = result
+                        self.process_attachments(attachments, from_addr, subject, self.cache_key(uid), message_id)
+                    else:
+                        uid, email_body = result
+                        self.process_message(email_body, uid, self.cache_key(uid))
+                    processed += 1
+                if state is not None:
+                    # Only checkpoint emails whose reports have been merged
+                    self.wait_for_parsing()
+                    state.update(self.email_address, self.imap_server, mailbox, uidvalidity, batch[-1])
+                    state.save()
+            
+            if state is not None:
+                self.wait_for_parsing()
+                if email_ids:
+                    state.update(self.email_address, self.imap_server, mailbox, uidvalidity, email_ids[-1])
+                state.save()
+            
+            self.finish_parsing()
+            self.metrics.inc('messages', processed)
+            elapsed = time.monotonic() - started
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            megabytes = self.bytes_downloaded / (1024 * 1024)
+            print(f"\n{Colors.BLUE}Processed {processed} emails ({megabytes:.1f} MB downloaded) "
+                  f"in {elapsed:.2f}s ({rate:.1f} msg/s){Colors.END}")
+            return len(email_ids)
                 
         except Exception as e:
+            self.metrics.error('fetch', e)
             print(f"{Colors.RED}Error fetching emails: {str(e)}{Colors.END}")
     
+    def fetch_accounts(self, accounts, limit=50, batch_size=FETCH_BATCH_SIZE, state=None, attachments_only=False,
+                       connections=1):
+        """Fetch every account/mailbox from load_accounts() concurrently and merge the results
+        
+        Each mailbox is fetched in its own thread over a connection borrowed from
+        its account's IMAPConnectionPool (at most `connections` per account, unless
+        the account sets its own). Results are merged here in config order, so the
+        combined report, store, export and checkpoints are only touched by this
+        thread and come out the same as fetching the mailboxes one after another.
+        """
+        jobs = [(account, mailbox) for account in accounts for mailbox in account['mailboxes']]
+        pools = [IMAPConnectionPool(self.account_connector(account), account['connections'] or connections)
+                 for account in accounts]
+        pool_of = {id(account): pool for account, pool in zip(accounts, pools)}
+        print(f"{Colors.BLUE}Fetching {len(jobs)} mailboxes from {len(accounts)} accounts{Colors.END}\n")
+        
+        def fetch_mailbox(account, mailbox):
+            collector = self.account_parser(account)
+            job_state = None
+            if state is not None:
+                # Checkpoints are only saved once the results have been merged
+                job_state = SyncState(None)
+                checkpoint = state.get(account['email'], account['server'], mailbox)
+                if checkpoint:
+                    job_state.checkpoints[SyncState.key(account['email'], account['server'], mailbox)] = checkpoint
+            pool = pool_of[id(account)]
+            collector.mail = pool.acquire(mailbox)
+            try:
+                collector.fetch_dmarc_reports(mailbox, limit, batch_size, job_state, attachments_only)
+                collector.mail.noop()
+            except Exception:
+                pool.discard(collector.mail)
+                raise
+            pool.release(collector.mail)
+            if collector.metrics.enabled:
+                collector.events.append(('metrics', collector.metrics.to_dict()))
+            return collector.events, job_state
+        
+        started = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=min(len(jobs), sum(pool.size for pool in pools)))
+        try:
+            futures = [executor.submit(fetch_mailbox, account, mailbox) for account, mailbox in jobs]
+            for (account, mailbox), future in zip(jobs, futures):
+                try:
+                    events, job_state = future.result()
+                except Exception as e:
+                    self.metrics.error('fetch', e)
+                    print(f"{Colors.RED}Error fetching {account['email']} {mailbox}: {str(e)}{Colors.END}")
+                    continue
+                print(f"{Colors.CYAN}{account['email']} {mailbox}:{Colors.END}")
+                self.merge_parsed(events)
+                if job_state is not None:
+                    state.checkpoints.update(job_state.checkpoints)
+                    state.save()
+        finally:
+            executor.shutdown()
+            for pool in pools:
+                pool.close()
+        print(f"\n{Colors.BLUE}Fetched {len(jobs)} mailboxes in {time.monotonic() - started:.2f}s{Colors.END}")
+    
+    def account_parser(self, account):
+        """Parser for one account of fetch_accounts() that collects reports instead of merging them"""
+        collector = _ReportCollector(self.stream, account['email'], account['password'], account['server'],
+                                     self.verbose, account['port'], account['ssl'])
+        collector.metrics = self.metrics.child()
+        return collector
+    
+    def account_connector(self, account):
+        """open_connection() for an account of fetch_accounts(), timed in this parser's metrics"""
+        connector = self.account_parser(account)
+        connector.metrics = self.metrics
+        return connector.open_connection
+    
+    def cache_key(self, uid):
+        """Attachment cache key of an email in the selected mailbox"""
+        if self.cache is None:
+            return None
+        return f'{self.email_address}|{self.imap_server}|{self.mailbox}|{self.uidvalidity}|{uid}'
+    
+    def replay_cached_email(self, uid):
+        """Parse a previously fetched email from the attachment cache; False if not cached"""
+        entries = self.cache.lookup(self.cache_key(uid))
+        if not entries:
+            return False
+        for digest, filename, from_addr, subject in entries:
+            file_data = self.cache.get(digest)
+            if file_data is None:
+                return False
+            self.parse_dmarc_xml(file_data, filename, from_addr, subject, self.cache_key(uid))
+        self.metrics.inc('cache_hits')
+        return True
+    
+    def iter_fetched_batches(self, mailbox, email_ids, batch_size, attachments_only=False, workers=1):
+        """Yield (batch, results) in UID order, downloading over `workers` connections
+        
+        Workers pull batches in order and hand results to this generator, so
+        downloading overlaps with the caller's parsing. A worker only takes a new
+        batch once fewer than `workers` batches are downloaded or in flight ahead
+        of the caller, so memory stays bounded by a few batches even when an early
+        batch is slow. Out-of-order completions are buffered so the caller always
+        sees batches in order, which keeps results deterministic and lets UID
+        checkpoints advance safely.
+        """
+        batches = [email_ids[i:i + batch_size] for i in range(0, len(email_ids), batch_size)]
+        fetch = self.fetch_report_attachments if attachments_only else self.fetch_messages
+        if workers <= 1 or len(batches) <= 1:
+            for batch in batches:
+                yield batch, fetch(batch)
+            return
+        
+        workers = min(workers, len(batches))
+        pool = IMAPConnectionPool(self.open_connection, workers)
+        jobs = queue.Queue()
+        for job in enumerate(batches):
+            jobs.put(job)
+        results = queue.Queue()
+        window = threading.Semaphore(workers)  # Released as batches are yielded
+        stop = threading.Event()
+        
+        def worker():
+            while not stop.is_set():
+                if not window.acquire(timeout=0.05):
+                    continue
+                try:
+                    index, batch = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    result = self.fetch_with_retry(pool, mailbox, fetch, batch)
+                except Exception as e:
+                    result = e
+                results.put((index, result))
+        
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        if self.verbose:
+            print(f"{Colors.CYAN}Fetching {len(batches)} batches with {workers} IMAP connections{Colors.END}")
+        
+        try:
+            completed = {}
+            for index, batch in enumerate(batches):
+                while index not in completed:
+                    done_index, result = results.get()
+                    completed[done_index] = result
+                result = completed.pop(index)
+                window.release()
+                if isinstance(result, Exception):
+                    raise result
+                yield batch, result
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            pool.close()
+    
+    def fetch_with_retry(self, pool, mailbox, fetch, batch):
+        """Run a batch fetch on a pooled connection, reconnecting on transient errors"""
+        for attempt in range(1, FETCH_RETRIES + 1):
+            conn = None
+            try:
+                conn = pool.acquire(mailbox)
+                result = fetch(batch, conn)
+            except (imaplib.IMAP4.abort, OSError) as e:
+                if conn is not None:
+                    pool.discard(conn)
+                if attempt == FETCH_RETRIES:
+                    raise
+                self.metrics.inc('fetch_retries')
+                print(f"{Colors.YELLOW}Warning: IMAP error fetching {len(batch)} emails ({str(e)}), "
+                      f"retrying (attempt {attempt + 1}/{FETCH_RETRIES}){Colors.END}")
+                time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            except Exception:
+                if conn is not None:
+                    pool.release(conn)
+                raise
+            else:
+                pool.release(conn)
+                return result
+    
+    def get_uidvalidity(self, mailbox):
+        """Return the UIDVALIDITY of the selected mailbox"""
+        status, data = self.mail.response('UIDVALIDITY')
+        if not data or data[0] is None:
+            status, data = self.mail.status(mailbox, '(UIDVALIDITY)')
+            data = re.findall(rb'UIDVALIDITY (\d+)', data[0])
+        return int(data[0])
+    
+    def search_dmarc_uids(self, criteria=DMARC_SEARCH_CRITERIA, since_uid=0):
+        """Run a single UID SEARCH for all criteria and return sorted UIDs"""
+        query = build_search_query(criteria)
+        if since_uid:
+            query = f'UID {since_uid + 1}:* {query}'
+        if self.verbose:
+            print(f"{Colors.CYAN}  UID SEARCH {query}{Colors.END}")
+        
+        with self.metrics.time('search'):
+            status, messages = self.mail.uid('SEARCH', None, query)
+        if status != 'OK' or not messages[0]:
+            return []
+        # "N:*" always matches the newest message, even when its UID is below N
+        return sorted({int(uid) for uid in messages[0].split() if int(uid) > since_uid})
+    
+    def fetch_messages(self, uids, conn=None):
+        """Fetch full messages for a batch of UIDs with one UID FETCH command"""
+        if not uids:
+            return []
+        
+        conn = conn or self.mail
+        with self.metrics.time('download', 'fetch_batch_seconds'):
+            status, data = conn.uid('FETCH', compress_uid_set(uids), '(RFC822)')
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+        
+        messages = []
+        for item in parse_fetch_response(data):
+            # Unsolicited FLAGS updates carry no UID or body
+            if 'UID' in item and item.get('RFC822') is not None:
+                messages.append((int(item['UID']), item['RFC822']))
+                self.count_download(len(item['RFC822']))
+                self.metrics.observe('message_bytes', len(item['RFC822']))
+        return sorted(messages)
+    
+    def count_download(self, size):
+        with self._counter_lock:
+            self.bytes_downloaded += size
+        self.metrics.inc('bytes_downloaded', size)
+    
+    def fetch_report_attachments(self, uids, conn=None):
+        """Screen a batch on ENVELOPE/BODYSTRUCTURE and download only report parts
+        
+        Returns (uid, subject, from_addr, attachments, message_id) per message, where
+        attachments is a list of (filename, data), or None when the subject is not a
+        DMARC report.
+        """
+        if not uids:
+            return []
+        
+        conn = conn or self.mail
+        with self.metrics.time('download', 'fetch_batch_seconds'):
+            status, data = conn.uid('FETCH', compress_uid_set(uids), '(ENVELOPE BODYSTRUCTURE)')
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+        
+        messages = {}
+        sections_needed = defaultdict(list)
+        for item in parse_fetch_response(data):
+            if 'UID' not in item or 'ENVELOPE' not in item:
+                continue
+            uid = int(item['UID'])
+            envelope = item['ENVELOPE']
+            subject = self.decode_header_value(_imap_text(envelope[1]))
+            from_addr = ''
+            if envelope[2]:
+                name, _, mailbox, host = envelope[2][0]
+                from_addr = formataddr((self.decode_header_value(_imap_text(name)),
+                                        f'{_imap_text(mailbox)}@{_imap_text(host)}'))
+            
+            message_id = _imap_text(envelope[9]) or None
+            if not is_report_subject(subject):
+                messages[uid] = (subject, from_addr, None, [], message_id)
+                continue
+            parts = find_report_parts(item['BODYSTRUCTURE'])
+            messages[uid] = (subject, from_addr, [], parts, message_id)
+            if parts:
+                sections_needed[tuple(section for section, _, _ in parts)].append(uid)
+        
+        # Messages needing the same sections (usually just BODY[2]) share one FETCH
+        for sections, group in sections_needed.items():
+            items = ' '.join(f'BODY.PEEK[{section}]' for section in sections)
+            with self.metrics.time('download', 'fetch_batch_seconds'):
+                status, data = conn.uid('FETCH', compress_uid_set(group), f'({items})')
+            if status != 'OK':
+                raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+            for item in parse_fetch_response(data):
+                if 'UID' not in item or int(item['UID']) not in messages:
+                    continue
+                subject, from_addr, attachments, parts, _ = messages[int(item['UID'])]
+                for section, filename, encoding in parts:
+                    body = item.get(f'BODY[{section}]')
+                    if body:
+                        self.count_download(len(body))
+                        attachments.append((filename, decode_transfer_encoding(body, encoding)))
+        
+        return [(uid, subject, from_addr, attachments, message_id)
+                for uid, (subject, from_addr, attachments, _, message_id) in sorted(messages.items())]
+    
+    def process_attachments(self, attachments, from_addr, subject, cache_key=None, message_id=None):
+        """Parse report attachments downloaded by fetch_report_attachments"""
+        if attachments is None:
+            return
+        if not attachments:
+            print(f"{Colors.YELLOW}Note: Email with subject '{subject[:50]}...' has no XML/GZ/ZIP attachment{Colors.END}")
+        for filename, file_data in attachments:
+            if file_data:
+                self.parse_dmarc_xml(file_data, filename, from_addr, subject, cache_key, message_id)
+    
     def process_email(self, email_id):
         """Process individual email and extract XML attachments"""
         try:
@@ -105,14 +2066,22 @@ class DMARCParser:
             if status != 'OK':
                 return
             
-            email_body = msg_data[0][1]
+            self.process_message(msg_data[0][1], email_id)
+                    
+        except Exception as e:
+            self.metrics.error('message', e)
+            print(f"{Colors.YELLOW}Warning: Could not process email {email_id}: {str(e)}{Colors.END}")
+    
+    def process_message(self, email_body, email_id=None, cache_key=None):
+        """Extract and parse XML attachments from a raw RFC822 message"""
+        try:
             email_message = email.message_from_bytes(email_body)
             
             subject = self.decode_header_value(email_message['Subject'])
             from_addr = email_message['From']
             
             # Debug: Check if this looks like a DMARC report
-            if 'Report Domain:' in subject or 'dmarc' in subject.lower() or 'aggregate' in subject.lower():
+            if is_report_subject(subject):
                 found_attachment = False
                 
                 # Process attachments
@@ -123,16 +2092,18 @@ class DMARCParser:
                     filename = part.get_filename()
                     if filename:
                         # Check for DMARC report file extensions
-                        if filename.endswith(('.xml', '.gz', '.zip')):
+                        if filename.endswith(REPORT_EXTENSIONS):
                             found_attachment = True
                             file_data = part.get_payload(decode=True)
                             if file_data:
-                                self.parse_dmarc_xml(file_data, filename, from_addr, subject)
+                                self.parse_dmarc_xml(file_data, filename, from_addr, subject,
+                                                     cache_key, email_message['Message-ID'])
                 
                 if not found_attachment:
                     print(f"{Colors.YELLOW}Note: Email with subject '{subject[:50]}...' has no XML/GZ/ZIP attachment{Colors.END}")
                     
         except Exception as e:
+            self.metrics.error('message', e)
             print(f"{Colors.YELLOW}Warning: Could not process email {email_id}: {str(e)}{Colors.END}")
     
     def decode_header_value(self, value):
@@ -148,30 +2119,138 @@ class DMARCParser:
                 header_text += text
         return header_text
     
-    def parse_dmarc_xml(self, file_data, filename, from_addr, subject):
-        """Parse DMARC XML from attachment"""
-        try:
-            xml_content = None
+    def parse_cached_attachments(self, cache):
+        """Re-analyze every distinct attachment in an AttachmentCache without IMAP"""
+        started = time.monotonic()
+        count = 0
+        for digest, filename, from_addr, subject in cache.iter_attachments():
+            file_data = cache.get(digest)
+            if file_data is not None:
+                self.parse_dmarc_xml(file_data, filename, from_addr, subject)
+                count += 1
+        self.finish_parsing()
+        elapsed = time.monotonic() - started
+        print(f"\n{Colors.BLUE}Parsed {count} cached attachments in {elapsed:.2f}s{Colors.END}")
+    
+    def ingest_paths(self, paths, progress_interval=5.0):
+        """Parse reports from local files, directories, mbox files and Maildir folders
+        
+        .xml/.gz/.zip files are parsed directly, while .eml files, mbox files and
+        Maildir folders (including Maildir++ subfolders) go through
+        process_message() like fetched emails. Progress is printed every
+        progress_interval seconds, followed by a throughput summary.
+        """
+        started = last_progress = time.monotonic()
+        counts = {'report': 0, 'email': 0}
+        
+        def report_progress(final=False):
+            elapsed = time.monotonic() - started
+            rate = (counts['report'] + counts['email']) / elapsed if elapsed > 0 else 0.0
+            label = 'Ingested' if final else '  Progress:'
+            print(f"{Colors.BLUE}{label} {counts['report']} report files and {counts['email']} emails "
+                  f"in {elapsed:.2f}s ({rate:.1f} items/s, {len(self.reports)} reports parsed){Colors.END}")
+        
+        for kind, path in iter_local_sources(paths):
+            try:
+                if kind == 'report':
+                    with open(path, 'rb') as f:
+                        file_data = f.read() if self.parse_workers > 1 or self.cache is not None else f
+                        self.parse_dmarc_xml(file_data, os.path.basename(path), '', os.path.basename(path))
+                    counts['report'] += 1
+                else:
+                    for key, email_body in self.iter_local_emails(kind, path):
+                        self.process_message(email_body, key)
+                        counts['email'] += 1
+            except (OSError, mailboxlib.Error) as e:
+                self.metrics.error('read', e)
+                reason = e.strerror if isinstance(e, OSError) else type(e).__name__
+                print(f"{Colors.YELLOW}Warning: Could not read {path}: {reason}{Colors.END}")
             
-            # Handle compressed files
-            if filename.endswith('.gz'):
-                xml_content = gzip.decompress(file_data)
-            elif filename.endswith('.zip'):
-                with zipfile.ZipFile(io.BytesIO(file_data)) as zf:
-                    # Get first XML file in zip
-                    for name in zf.namelist():
-                        if name.endswith('.xml'):
-                            xml_content = zf.read(name)
-                            break
-            elif filename.endswith('.xml'):
-                xml_content = file_data
-            else:
+            if time.monotonic() - last_progress >= progress_interval:
+                self.wait_for_parsing()
+                report_progress()
+                last_progress = time.monotonic()
+        
+        self.finish_parsing()
+        self.metrics.inc('messages', counts['email'])
+        print()
+        report_progress(final=True)
+    
+    def iter_local_emails(self, kind, path):
+        """Yield (key, raw message) from an .eml file, mbox file or Maildir"""
+        if kind == 'email':
+            with open(path, 'rb') as f:
+                yield path, f.read()
+            return
+        
+        if kind == 'mbox':
+            boxes = [(path, mailboxlib.mbox(path, create=False))]
+        else:
+            boxes = [(path, mailboxlib.Maildir(path, factory=None, create=False))]
+            boxes += [(os.path.join(path, f'.{name}'), boxes[0][1].get_folder(name))
+                      for name in sorted(boxes[0][1].list_folders())]
+        
+        for box_path, box in boxes:
+            try:
+                for key in box.iterkeys():
+                    yield f'{box_path}:{key}', box.get_bytes(key)
+            finally:
+                box.close()
+    
+    def parse_files(self, paths):
+        """Parse local .xml/.gz/.zip report files"""
+        for path in paths:
+            with open(path, 'rb') as f:
+                file_data = f.read() if self.parse_workers > 1 else f
+                self.parse_dmarc_xml(file_data, os.path.basename(path), '', os.path.basename(path))
+        self.finish_parsing()
+    
+    def parse_dmarc_xml(self, file_data, filename, from_addr, subject, cache_key=None, message_id=None):
+        """Parse DMARC XML from attachment
+        
+        file_data may be bytes or a binary file object. Every XML member of a zip
+        archive is analyzed. With parse_workers > 1 the attachment (as bytes) is
+        handed to a process pool; call finish_parsing() to collect the results.
+        
+        With an attachment cache, the attachment is stored under its content
+        hash and an attachment already parsed in this run is skipped.
+        """
+        if self.cache is not None:
+            if not isinstance(file_data, (bytes, bytearray)):
+                file_data = file_data.read()
+            digest = self.cache.put(file_data, filename, from_addr, subject, cache_key, message_id)
+            if digest in self.parsed_digests:
+                if self.verbose:
+                    print(f"{Colors.CYAN}Skipping duplicate attachment {filename}{Colors.END}")
                 return
-            
-            if xml_content:
-                self.analyze_xml(xml_content, filename, from_addr, subject)
+            self.parsed_digests.add(digest)
+        
+        if self.parse_workers > 1:
+            if self.parse_pool is None:
+                self.parse_pool = ParsePool(self, self.parse_workers)
+            self.parse_pool.submit(file_data, filename, from_addr, subject)
+            return
+        
+        if self.metrics.enabled:
+            self.metrics.inc('attachments')
+            size = len(file_data) if isinstance(file_data, (bytes, bytearray)) else os.fstat(file_data.fileno()).st_size
+            self.metrics.observe('attachment_bytes', size)
+        try:
+            for name, stream in open_report_streams(file_data, filename):
+                if self.stream:
+                    # Decompression is interleaved with parsing and counted as parse time
+                    with self.metrics.time('parse', 'report_parse_seconds'):
+                        self.analyze_xml_stream(stream, filename, from_addr, subject)
+                    continue
+                
+                with self.metrics.time('decompress'):
+                    xml_content = stream.read()
+                if xml_content:
+                    with self.metrics.time('parse', 'report_parse_seconds'):
+                        self.analyze_xml(xml_content, filename, from_addr, subject)
                 
         except Exception as e:
+            self.metrics.error('decompress', e)
             print(f"{Colors.YELLOW}Warning: Could not parse {filename}: {str(e)}{Colors.END}")
     
     def analyze_xml(self, xml_content, filename, from_addr, subject):
@@ -179,57 +2258,162 @@ class DMARCParser:
         try:
             root = ET.fromstring(xml_content)
             
-            # Extract metadata
-            report_metadata = root.find('report_metadata')
-            org_name = report_metadata.find('org_name').text if report_metadata.find('org_name') is not None else 'Unknown'
-            report_id = report_metadata.find('report_id').text if report_metadata.find('report_id') is not None else 'Unknown'
-            
-            date_range = report_metadata.find('date_range')
-            date_begin = datetime.fromtimestamp(int(date_range.find('begin').text))
-            date_end = datetime.fromtimestamp(int(date_range.find('end').text))
-            
-            # Extract policy
-            policy_published = root.find('policy_published')
-            domain = policy_published.find('domain').text
-            dmarc_policy = policy_published.find('p').text
-            
-            report_info = {
-                'filename': filename,
-                'org_name': org_name,
-                'report_id': report_id,
-                'domain': domain,
-                'date_begin': date_begin.strftime('%Y-%m-%d %H:%M:%S'),
-                'date_end': date_end.strftime('%Y-%m-%d %H:%M:%S'),
-                'dmarc_policy': dmarc_policy,
-                'records': []
-            }
+            report_info = self.build_report_info(root.find('report_metadata'), root.find('policy_published'),
+                                                 filename)
             
             # Process records
             has_failures = False
             for record in root.findall('record'):
-                record_data = self.parse_record(record)
-                report_info['records'].append(record_data)
+                has_failures |= self.add_record(report_info, self.parse_record(record))
+            
+            self.finish_report(report_info, has_failures)
                 
-                if record_data['has_failure']:
-                    has_failures = True
-                    self.failures.append({
-                        'domain': domain,
-                        'org_name': org_name,
-                        'report_id': report_id,
-                        'date': date_begin.strftime('%Y-%m-%d'),
-                        **record_data
-                    })
+        except Exception as e:
+            self.metrics.error('parse', e)
+            print(f"{Colors.RED}Error analyzing XML: {str(e)}{Colors.END}")
+    
+    def analyze_xml_stream(self, stream, filename, from_addr, subject):
+        """Analyze a DMARC XML report incrementally from a binary stream
+        
+        Records are parsed one at a time and discarded once handled, so memory
+        use does not grow with the number of records. The report keeps a
+        record_count instead of the full record list.
+        """
+        try:
+            report_metadata = policy_published = report_info = None
+            has_failures = False
             
-            self.reports.append(report_info)
+            context = ET.iterparse(stream, events=('start', 'end'))
+            _, root = next(context)
+            for event, elem in context:
+                if event != 'end':
+                    continue
+                if elem.tag == 'report_metadata':
+                    report_metadata = elem
+                elif elem.tag == 'policy_published':
+                    policy_published = elem
+                elif elem.tag == 'record':
+                    # Metadata and policy precede records in the aggregate report schema
+                    if report_info is None:
+                        report_info = self.build_report_info(report_metadata, policy_published, filename,
+                                                             keep_records=False)
+                    has_failures |= self.add_record(report_info, self.parse_record(elem))
+                    root.clear()
             
-            if has_failures:
-                print(f"{Colors.RED}⚠ FAILURES FOUND{Colors.END} in report from {Colors.BOLD}{org_name}{Colors.END} for domain {Colors.BOLD}{domain}{Colors.END}")
-            else:
-                print(f"{Colors.GREEN}✓ All passed{Colors.END} in report from {org_name} for {domain}")
+            if report_info is None:
+                report_info = self.build_report_info(report_metadata, policy_published, filename,
+                                                     keep_records=False)
+            self.finish_report(report_info, has_failures)
                 
         except Exception as e:
+            self.metrics.error('parse', e)
             print(f"{Colors.RED}Error analyzing XML: {str(e)}{Colors.END}")
     
+    def merge_parsed(self, events, report=None):
+        """Merge events from parse_attachment() as if the report was parsed here
+        
+        Returns the [report_info, has_failures] of a report left unfinished, to
+        be passed back in with the next chunk of events for the same attachment.
+        """
+        for event in events:
+            if event[0] == 'output':
+                sys.stdout.write(event[1])
+                continue
+            if event[0] == 'metrics':
+                self.metrics.merge(event[1])
+                continue
+            if event[0] == 'report':
+                report = [event[1], False]
+            records, finished = event[-2:]
+            for record_data in records:
+                report[1] |= self.add_record(report[0], record_data)
+            if finished:
+                self.finish_report(*report)
+                report = None
+        return report
+    
+    def wait_for_parsing(self):
+        """Merge all attachments submitted to the process pool so far"""
+        if self.parse_pool is not None:
+            self.parse_pool.drain()
+    
+    def finish_parsing(self):
+        """Merge outstanding results and shut down the process pool"""
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown()
+            self.parse_pool = None
+    
+    def build_report_info(self, report_metadata, policy_published, filename, keep_records=True):
+        """Build the report summary dict from <report_metadata> and <policy_published>"""
+        # Extract metadata
+        org_name = report_metadata.find('org_name').text if report_metadata.find('org_name') is not None else 'Unknown'
+        report_id = report_metadata.find('report_id').text if report_metadata.find('report_id') is not None else 'Unknown'
+        
+        date_range = report_metadata.find('date_range')
+        date_begin = datetime.fromtimestamp(int(date_range.find('begin').text))
+        date_end = datetime.fromtimestamp(int(date_range.find('end').text))
+        
+        # Extract policy
+        domain = policy_published.find('domain').text
+        dmarc_policy = policy_published.find('p').text
+        
+        report_info = {
+            'filename': filename,
+            'org_name': _intern(org_name),
+            'report_id': report_id,
+            'domain': _intern(domain),
+            'date_begin': date_begin.strftime('%Y-%m-%d %H:%M:%S'),
+            'date_end': date_end.strftime('%Y-%m-%d %H:%M:%S'),
+            'dmarc_policy': _intern(dmarc_policy),
+        }
+        if keep_records:
+            report_info['records'] = []
+        else:
+            report_info['record_count'] = 0
+        return report_info
+    
+    def add_record(self, report_info, record_data):
+        """Attach a parsed record to its report; returns True if it is a failure"""
+        if self.store is not None:
+            self.store.add_record(report_info, record_data)
+        return self.collect_record(report_info, record_data)
+    
+    def collect_record(self, report_info, record_data):
+        """Add a record to the in-memory report and failure lists"""
+        if self.exporter is not None:
+            # Streamed out instead of kept on the report
+            self.exporter.add_record(report_info, record_data)
+        elif 'records' in report_info:
+            report_info['records'].append(record_data)
+        else:
+            report_info['record_count'] += 1
+        
+        if self.rollup is not None:
+            self.rollup.add(report_info, record_data)
+        if self.detector is not None:
+            self.detector.add(report_info, record_data)
+        self.metrics.inc('records')
+        if record_data['has_failure']:
+            self.metrics.inc('failures')
+            self.failures.append(FailureRecord(report_info, record_data))
+        return record_data['has_failure']
+    
+    def finish_report(self, report_info, has_failures):
+        """Record a fully analyzed report and print its status line"""
+        if self.store is not None:
+            self.store.finish_report(report_info)
+        if self.exporter is not None:
+            self.exporter.finish_report(report_info)
+        self.reports.append(report_info)
+        self.metrics.inc('reports')
+        
+        org_name = report_info['org_name']
+        domain = report_info['domain']
+        if has_failures:
+            print(f"{Colors.RED}⚠ FAILURES FOUND{Colors.END} in report from {Colors.BOLD}{org_name}{Colors.END} for domain {Colors.BOLD}{domain}{Colors.END}")
+        else:
+            print(f"{Colors.GREEN}✓ All passed{Colors.END} in report from {org_name} for {domain}")
+    
     def parse_record(self, record):
         """Parse individual DMARC record"""
         row = record.find('row')
@@ -249,133 +2433,186 @@ class DMARCParser:
             for dkim in auth_results.findall('dkim'):
                 dkim_domain = dkim.find('domain').text if dkim.find('domain') is not None else 'N/A'
                 dkim_auth_result = dkim.find('result').text if dkim.find('result') is not None else 'none'
-                dkim_details.append({'domain': dkim_domain, 'result': dkim_auth_result})
+                dkim_details.append((dkim_domain, dkim_auth_result))
         
         spf_details = []
         if auth_results.find('spf') is not None:
             for spf in auth_results.findall('spf'):
                 spf_domain = spf.find('domain').text if spf.find('domain') is not None else 'N/A'
                 spf_auth_result = spf.find('result').text if spf.find('result') is not None else 'none'
-                spf_details.append({'domain': spf_domain, 'result': spf_auth_result})
-        
-        # Determine if there are failures
-        has_failure = (dkim_result != 'pass' or spf_result != 'pass')
+                spf_details.append((spf_domain, spf_auth_result))
         
         # Get identifiers
         identifiers = record.find('identifiers')
         header_from = identifiers.find('header_from').text if identifiers.find('header_from') is not None else 'N/A'
         
-        return {
-            'source_ip': source_ip,
-            'count': count,
-            'disposition': disposition,
-            'dkim_result': dkim_result,
-            'spf_result': spf_result,
-            'dkim_details': dkim_details,
-            'spf_details': spf_details,
-            'header_from': header_from,
-            'has_failure': has_failure
-        }
+        # has_failure is derived from the DKIM/SPF results
+        return DMARCRecord(source_ip, count, disposition, dkim_result, spf_result, dkim_details, spf_details,
+                           header_from)
+    
+    def load_from_store(self, store, domain=None, since=None, until=None):
+        """Replace in-memory results with reports read from a ReportStore"""
+        self.reports = []
+        self.failures = []
+        for report_info, records in store.iter_reports(domain, since, until):
+            for record_data in records:
+                self.collect_record(report_info, record_data)
+            if self.exporter is not None:
+                self.exporter.finish_report(report_info)
+            self.reports.append(report_info)
+        print(f"{Colors.BLUE}Loaded {len(self.reports)} reports from {store.path}{Colors.END}")
     
-    def generate_report(self):
-        """Generate detailed failure report"""
+    def generate_report(self, detailed=False, top=10):
+        """Print the failure report
+        
+        By default failures of each domain are collapsed by source IP, DKIM/SPF
+        result and disposition, the top groups are listed and each distinct
+        recommendation is printed once. detailed=True prints every failure
+        record with its own recommendations.
+        """
+        self.finish_parsing()
         if not self.failures:
             print(f"\n{Colors.GREEN}{Colors.BOLD}🎉 No DMARC failures found! All authentication checks passed.{Colors.END}\n")
             return
         
-        print(f"\n{Colors.RED}{Colors.BOLD}{'='*80}{Colors.END}")
-        print(f"{Colors.RED}{Colors.BOLD}DMARC AUTHENTICATION FAILURES REPORT{Colors.END}")
-        print(f"{Colors.RED}{Colors.BOLD}{'='*80}{Colors.END}\n")
-        
-        # Group failures by domain
-        failures_by_domain = defaultdict(list)
-        for failure in self.failures:
-            failures_by_domain[failure['domain']].append(failure)
-        
-        for domain, failures in failures_by_domain.items():
-            print(f"{Colors.CYAN}{Colors.BOLD}Domain: {domain}{Colors.END}")
-            print(f"{Colors.CYAN}{'─'*80}{Colors.END}")
+        with self.metrics.time('report'), buffered_stdout():
+            print(f"\n{Colors.RED}{Colors.BOLD}{'='*80}{Colors.END}")
+            print(f"{Colors.RED}{Colors.BOLD}DMARC AUTHENTICATION FAILURES REPORT{Colors.END}")
+            print(f"{Colors.RED}{Colors.BOLD}{'='*80}{Colors.END}\n")
             
-            total_failed_count = sum(f['count'] for f in failures)
-            print(f"Total failed messages: {Colors.RED}{Colors.BOLD}{total_failed_count}{Colors.END}\n")
+            # Group failures by domain
+            failures_by_domain = defaultdict(list)
+            for failure in self.failures:
+                failures_by_domain[failure['domain']].append(failure)
             
-            for idx, failure in enumerate(failures, 1):
-                print(f"{Colors.YELLOW}Failure #{idx}:{Colors.END}")
-                print(f"  Source IP: {failure['source_ip']}")
-                print(f"  Count: {failure['count']} messages")
-                print(f"  Header From: {failure['header_from']}")
-                print(f"  Date: {failure['date']}")
-                print(f"  Reporter: {failure['org_name']}")
+            for domain, failures in failures_by_domain.items():
+                print(f"{Colors.CYAN}{Colors.BOLD}Domain: {domain}{Colors.END}")
+                print(f"{Colors.CYAN}{'─'*80}{Colors.END}")
                 
-                # DKIM Status
-                if failure['dkim_result'] != 'pass':
-                    print(f"  {Colors.RED}✗ DKIM: {failure['dkim_result'].upper()}{Colors.END}")
-                    if failure['dkim_details']:
-                        for dkim in failure['dkim_details']:
-                            print(f"    - Domain: {dkim['domain']}, Result: {dkim['result']}")
+                total_failed_count = sum(f['count'] for f in failures)
+                if detailed:
+                    print(f"Total failed messages: {Colors.RED}{Colors.BOLD}{total_failed_count}{Colors.END}\n")
+                    self.print_failures(failures)
                 else:
-                    print(f"  {Colors.GREEN}✓ DKIM: PASS{Colors.END}")
-                
-                # SPF Status
-                if failure['spf_result'] != 'pass':
-                    print(f"  {Colors.RED}✗ SPF: {failure['spf_result'].upper()}{Colors.END}")
-                    if failure['spf_details']:
-                        for spf in failure['spf_details']:
-                            print(f"    - Domain: {spf['domain']}, Result: {spf['result']}")
-                else:
-                    print(f"  {Colors.GREEN}✓ SPF: PASS{Colors.END}")
-                
-                print(f"  Disposition: {failure['disposition']}")
-                
-                # Recommendations
-                print(f"\n  {Colors.MAGENTA}Recommendations:{Colors.END}")
-                self.print_recommendations(failure)
+                    self.print_failure_summary(failures, total_failed_count, top)
                 print()
             
+            # Summary
+            print(f"{Colors.BOLD}SUMMARY:{Colors.END}")
+            print(f"Total reports analyzed: {len(self.reports)}")
+            print(f"Reports with failures: {len(failures_by_domain)}")
+            print(f"Total failure records: {len(self.failures)}")
+            print(f"Total failed messages: {sum(f['count'] for f in self.failures)}")
+    
+    def print_failures(self, failures):
+        """Print every failure record with its recommendations"""
+        for idx, failure in enumerate(failures, 1):
+            print(f"{Colors.YELLOW}Failure #{idx}:{Colors.END}")
+            print(f"  Source IP: {failure['source_ip']}")
+            print(f"  Count: {failure['count']} messages")
+            print(f"  Header From: {failure['header_from']}")
+            print(f"  Date: {failure['date']}")
+            print(f"  Reporter: {failure['org_name']}")
+            if self.senders is not None:
+                sender = self.senders.lookup(failure['source_ip'])
+                print(f"  Sender: {f'{sender[0]} ({sender[1]})' if sender else 'unknown'}")
+            
+            # DKIM Status
+            if failure['dkim_result'] != 'pass':
+                print(f"  {Colors.RED}✗ DKIM: {failure['dkim_result'].upper()}{Colors.END}")
+                if failure['dkim_details']:
+                    for dkim in failure['dkim_details']:
+                        print(f"    - Domain: {dkim['domain']}, Result: {dkim['result']}")
+            else:
+                print(f"  {Colors.GREEN}✓ DKIM: PASS{Colors.END}")
+            
+            # SPF Status
+            if failure['spf_result'] != 'pass':
+                print(f"  {Colors.RED}✗ SPF: {failure['spf_result'].upper()}{Colors.END}")
+                if failure['spf_details']:
+                    for spf in failure['spf_details']:
+                        print(f"    - Domain: {spf['domain']}, Result: {spf['result']}")
+            else:
+                print(f"  {Colors.GREEN}✓ SPF: PASS{Colors.END}")
+            
+            print(f"  Disposition: {failure['disposition']}")
+            
+            # Recommendations
+            print(f"\n  {Colors.MAGENTA}Recommendations:{Colors.END}")
+            self.print_recommendations(failure)
             print()
+    
+    def print_failure_summary(self, failures, total_failed_count, top=10):
+        """Print failures collapsed by (source IP, DKIM, SPF, disposition), largest first"""
+        groups = {}
+        for failure in failures:
+            key = (failure['source_ip'], failure['dkim_result'], failure['spf_result'], failure['disposition'])
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [failure['count'], 1, failure]
+            else:
+                group[0] += failure['count']
+                group[1] += 1
+        ranked = sorted(groups.items(), key=lambda item: -item[1][0])
         
-        # Summary
-        print(f"{Colors.BOLD}SUMMARY:{Colors.END}")
-        print(f"Total reports analyzed: {len(self.reports)}")
-        print(f"Reports with failures: {len(failures_by_domain)}")
-        print(f"Total failure records: {len(self.failures)}")
-        print(f"Total failed messages: {sum(f['count'] for f in self.failures)}")
+        print(f"Total failed messages: {Colors.RED}{Colors.BOLD}{total_failed_count}{Colors.END} "
+              f"({len(failures)} records from {len({key[0] for key in groups})} source IPs)\n")
+        
+        labels = {}
+        if self.senders is not None:
+            # Failures from the same known sender together, then unknown IPs
+            by_sender = defaultdict(lambda: [0, 0, set()])
+            for key, (messages, records, _) in groups.items():
+                label = labels[key[0]] = self.senders.label(key[0])
+                totals = by_sender[label]
+                totals[0] += messages
+                totals[1] += records
+                totals[2].add(key[0])
+            print(f"  {'Messages':>10} {'Records':>8}  {'IPs':>6}  Sender")
+            for label, (messages, records, ips) in sorted(by_sender.items(),
+                                                          key=lambda item: (item[0] == 'unknown', -item[1][0])):
+                color = Colors.YELLOW if label == 'unknown' else Colors.GREEN
+                print(f"  {messages:>10} {records:>8}  {len(ips):>6}  {color}{label}{Colors.END}")
+            print()
+        
+        print(f"  {'Messages':>10} {'Records':>8}  {'Source IP':<39} {'DKIM':<10} {'SPF':<10} {'Disposition':<12}"
+              f"{'Sender' if labels else ''}".rstrip())
+        for (source_ip, dkim_result, spf_result, disposition), (messages, records, _) in ranked[:top]:
+            print(f"  {messages:>10} {records:>8}  {str(source_ip):<39} {str(dkim_result).upper():<10} "
+                  f"{str(spf_result).upper():<10} {str(disposition):<12}{labels.get(source_ip, '')}".rstrip())
+        if len(ranked) > top:
+            rest = sum(group[0] for _, group in ranked[top:])
+            print(f"  ... {len(ranked) - top} more groups ({rest} messages); use --detailed to list every record")
+        
+        # Each recommendation once under its heading; IP-specific lines (which
+        # come first in every section) stay ahead of the general ones
+        sections = {}
+        for _, (_, _, failure) in ranked[:top]:
+            for heading, lines in recommendations(failure, self.senders):
+                section = sections.setdefault(heading, {})
+                for position, line in enumerate(lines):
+                    section[line] = min(position, section.get(line, position))
+        print(f"\n  {Colors.MAGENTA}Recommendations:{Colors.END}")
+        for heading, lines in sorted(sections.items(), key=lambda item: RECOMMENDATION_HEADINGS.index(item[0])):
+            print(f"    {heading}")
+            for line in sorted(lines, key=lines.get):
+                print(f"    {line}")
     
     def print_recommendations(self, failure):
         """Print specific recommendations based on failure type"""
-        recommendations = []
-        
-        if failure['dkim_result'] != 'pass':
-            recommendations.append("DKIM Failure:")
-            recommendations.append("  • Verify DKIM signing is enabled on your mail server")
-            recommendations.append("  • Check DKIM private key configuration")
-            recommendations.append("  • Ensure DKIM DNS record is published correctly")
-            recommendations.append("  • Verify selector and domain match in email headers")
-        
-        if failure['spf_result'] != 'pass':
-            recommendations.append("SPF Failure:")
-            recommendations.append(f"  • Add IP {failure['source_ip']} to SPF record if legitimate")
-            recommendations.append("  • Review SPF record for missing authorized servers")
-            recommendations.append("  • Check for SPF record syntax errors")
-            recommendations.append("  • Ensure SPF record is not exceeding DNS lookup limit (10)")
-        
-        if failure['disposition'] == 'reject':
-            recommendations.append("CRITICAL: Messages are being REJECTED!")
-            recommendations.append("  • Immediate action required to prevent email delivery issues")
-        elif failure['disposition'] == 'quarantine':
-            recommendations.append("WARNING: Messages are being QUARANTINED (likely spam folder)")
-        
-        # IP reputation
-        recommendations.append("General recommendations:")
-        recommendations.append(f"  • Check IP reputation for {failure['source_ip']}")
-        recommendations.append("  • Verify this IP is authorized to send on your behalf")
-        recommendations.append("  • Use DMARC alignment to ensure domain consistency")
-        
-        for rec in recommendations:
-            print(f"    {rec}")
-    
-    def export_to_json(self, filepath='dmarc_failures.json'):
-        """Export failures to JSON file"""
+        for heading, lines in recommendations(failure, self.senders):
+            print(f"    {heading}")
+            for line in lines:
+                print(f"    {line}")
+    
+    def export_to_json(self, filepath='dmarc_failures.json', compact=False):
+        """Export failures to JSON file
+        
+        compact output has no indentation and leaves out the failures list,
+        which repeats records already present under all_reports. With --stream
+        the reports carry only a record_count, so the failures list is kept.
+        """
+        self.finish_parsing()
         output = {
             'generated_at': datetime.now().isoformat(),
             'total_reports': len(self.reports),
@@ -383,12 +2620,32 @@ class DMARCParser:
             'failures': self.failures,
             'all_reports': self.reports
         }
+        if self.detector is not None:
+            output['anomalies'] = self.detector.anomalies
         
         with open(filepath, 'w') as f:
-            json.dump(output, f, indent=2)
+            if compact:
+                if all('records' in report for report in self.reports):
+                    del output['failures']
+                json.dump(output, f, separators=(',', ':'), default=to_json)
+            else:
+                json.dump(output, f, indent=2, default=to_json)
         
         print(f"\n{Colors.GREEN}✓ Full report exported to: {filepath}{Colors.END}")
     
+    def export_results(self, filepath, output_format='json'):
+        """Finish the export selected with --format"""
+        if self.exporter is None:
+            self.finish_parsing()
+            with self.metrics.time('export'):
+                self.export_to_json(filepath, compact=output_format == 'compact')
+            return
+        self.finish_parsing()
+        with self.metrics.time('export'):
+            self.exporter.close()
+        print(f"\n{Colors.GREEN}✓ Exported {self.exporter.records} records from {self.exporter.reports} reports "
+              f"to: {self.exporter.path}{Colors.END}")
+    
     def disconnect(self):
         """Disconnect from IMAP server"""
         try:
@@ -398,6 +2655,326 @@ class DMARCParser:
             pass
 
 
+class _ReportCollector(DMARCParser):
+    """Parser used inside worker processes and fetch threads: collects reports instead of merging them"""
+    
+    def __init__(self, stream, email_address='', password='', imap_server='imap.gmail.com', verbose=False,
+                 port=None, use_ssl=True):
+        super().__init__(email_address, password, imap_server, verbose, stream, port=port, use_ssl=use_ssl)
+        self.events = []
+        self.chunks = None
+    
+    def write(self, text):
+        # Stands in for stdout so warnings keep their position among the reports
+        if self.events and self.events[-1][0] == 'output':
+            self.events[-1] = ('output', self.events[-1][1] + text)
+        else:
+            self.events.append(('output', text))
+    
+    def flush(self):
+        pass
+    
+    def build_report_info(self, report_metadata, policy_published, filename, keep_records=True):
+        report_info = super().build_report_info(report_metadata, policy_published, filename, keep_records)
+        self.events.append(['report', report_info, [], False])
+        return report_info
+    
+    def add_record(self, report_info, record_data):
+        records = self.events[-1][-2]
+        records.append(record_data)
+        if self.chunks is not None and len(records) >= PARSE_CHUNK_RECORDS:
+            # Blocks until the parent has merged earlier chunks
+            self.chunks.put(self.events)
+            self.events = [['records', [], False]]
+        return record_data['has_failure']
+    
+    def finish_report(self, report_info, has_failures):
+        self.events[-1][-1] = True
+
+
+def parse_attachment(file_data, filename, from_addr, subject, stream=False, metrics=False, chunks=None):
+    """Parse one report attachment in a worker process
+    
+    Returns a list of ['report', report_info, records, finished] and
+    ('output', text) events for DMARCParser.merge_parsed(), followed by a
+    ('metrics', Metrics.to_dict()) event when metrics is true. With a chunks
+    queue, events are put there every PARSE_CHUNK_RECORDS records, and a
+    report continues in ['records', records, finished] events.
+    """
+    collector = _ReportCollector(stream)
+    collector.chunks = chunks
+    if metrics:
+        collector.metrics = Metrics()
+    with contextlib.redirect_stdout(collector):
+        collector.parse_dmarc_xml(file_data, filename, from_addr, subject)
+    if metrics:
+        collector.events.append(('metrics', collector.metrics.to_dict()))
+    return collector.events
+
+
+class WatchDaemon:
+    """Keep a mailbox open and process DMARC reports as soon as they arrive
+    
+    New mail is detected with IMAP IDLE (re-issued every idle_timeout seconds)
+    or, on servers without IDLE, by sending NOOP every poll_interval seconds.
+    Each sync fetches only emails after the SyncState checkpoint, in rounds of
+    at most limit emails until the backlog is worked through. Connection
+    errors close the connection and retry with exponential backoff.
+    on_sync is called after every round, e.g. to report and reset results.
+    """
+    
+    def __init__(self, parser, mailbox='INBOX', state=None, limit=50, batch_size=FETCH_BATCH_SIZE,
+                 attachments_only=False, workers=1, poll_interval=60, idle_timeout=25 * 60, max_backoff=300,
+                 on_sync=None):
+        self.parser = parser
+        self.mailbox = mailbox
+        self.state = state if state is not None else SyncState()
+        self.limit = limit
+        self.batch_size = batch_size
+        self.attachments_only = attachments_only
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.max_backoff = max_backoff
+        self.on_sync = on_sync
+        self.stopped = threading.Event()
+        self.idle_lock = threading.Lock()
+        self.idle_conn = None
+        self.syncs = 0
+    
+    def run(self):
+        """Sync, wait for new mail and repeat until stop() is called"""
+        backoff = 1.0
+        needs_sync = True
+        while not self.stopped.is_set():
+            try:
+                if self.parser.mail is None:
+                    print(f"{Colors.CYAN}Connecting to {self.parser.imap_server}...{Colors.END}")
+                    self.parser.mail = self.parser.open_connection()
+                    # IDLE is ended well before this, so a timeout means the connection is dead
+                    self.parser.mail.sock.settimeout(max(self.idle_timeout, self.poll_interval) + 60)
+                    print(f"{Colors.GREEN}✓ Connected, watching {self.mailbox}{Colors.END}")
+                    needs_sync = True
+                if needs_sync:
+                    self.sync()
+                    backoff = 1.0
+                needs_sync = self.wait_for_mail()
+            except (imaplib.IMAP4.error, OSError) as e:
+                if self.stopped.is_set():
+                    break
+                print(f"{Colors.YELLOW}Connection lost ({e}), reconnecting in {backoff:.0f}s{Colors.END}")
+                self.drop_connection(logout=False)
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        self.drop_connection()
+    
+    def sync(self):
+        # A full round means more emails may be waiting, so fetch again before waiting for mail
+        while not self.stopped.is_set():
+            fetched = self.parser.fetch_dmarc_reports(self.mailbox, self.limit, self.batch_size, self.state,
+                                                      self.attachments_only, self.workers)
+            self.syncs += 1
+            if self.on_sync is not None:
+                self.on_sync()
+            if not self.limit or not fetched or fetched < self.limit:
+                break
+    
+    def wait_for_mail(self):
+        """Block until new messages are announced; False if the wait ended without any"""
+        conn = self.parser.mail
+        conn.response('EXISTS')  # Discard counts reported before the wait
+        if 'IDLE' in conn.capabilities:
+            return self.idle(conn)
+        while not self.stopped.wait(self.poll_interval):
+            conn.noop()
+            if conn.response('EXISTS')[1][0] is not None:
+                return True
+        return False
+    
+    def idle(self, conn):
+        """Run one IDLE command (RFC 2177); True if new messages were announced
+        
+        imaplib has no IDLE support, so the command is driven by hand. A timer
+        ends it with DONE after idle_timeout, as servers drop idle clients
+        after about 30 minutes.
+        """
+        tag = conn._new_tag()
+        conn.tagged_commands.pop(tag, None)
+        conn.send(tag + b' IDLE\r\n')
+        line = conn.readline()
+        if not line.startswith(b'+'):
+            raise imaplib.IMAP4.error(f'IDLE rejected: {line.decode(errors="replace").strip()}')
+        
+        with self.idle_lock:
+            self.idle_conn = conn
+        if self.stopped.is_set():
+            self.end_idle()
+        timer = threading.Timer(self.idle_timeout, self.end_idle)
+        timer.daemon = True
+        timer.start()
+        
+        new_mail = False
+        try:
+            while True:
+                line = conn.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort('connection closed during IDLE')
+                if line.startswith(tag + b' '):
+                    if line.split()[1].upper() != b'OK':
+                        raise imaplib.IMAP4.error(f'IDLE failed: {line.decode(errors="replace").strip()}')
+                    return new_mail
+                if line.rstrip().upper().endswith(b' EXISTS'):
+                    new_mail = True
+                    self.end_idle()
+        finally:
+            timer.cancel()
+            self.end_idle()
+    
+    def end_idle(self):
+        """Send DONE to end the current IDLE command, if any (safe from other threads)"""
+        with self.idle_lock:
+            conn, self.idle_conn = self.idle_conn, None
+        if conn is not None:
+            try:
+                conn.send(b'DONE\r\n')
+            except OSError:
+                pass
+    
+    def stop(self):
+        self.stopped.set()
+        self.end_idle()
+    
+    def drop_connection(self, logout=True):
+        if self.parser.mail is None:
+            return
+        if logout:
+            self.parser.disconnect()
+        try:
+            self.parser.mail.shutdown()
+        except Exception:
+            pass
+        self.parser.mail = None
+
+
+def load_accounts(path):
+    """Load the --config file of accounts and mailboxes to fetch
+    
+        {"accounts": [{"email": "dmarc@example.com", "password_env": "DMARC_PASSWORD",
+                       "server": "imap.gmail.com", "mailboxes": ["INBOX", "Reports"],
+                       "connections": 2}]}
+    
+    The password is given directly ("password") or read from the environment
+    variable named by "password_env". server, port, ssl, mailboxes and
+    connections are optional.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    accounts = []
+    for index, entry in enumerate(config.get('accounts', [])):
+        if 'email' not in entry:
+            raise ValueError(f'account #{index + 1} has no "email"')
+        password = entry.get('password')
+        if password is None and entry.get('password_env'):
+            password = os.environ.get(entry['password_env'])
+        if password is None:
+            raise ValueError(f'no password for {entry["email"]} (set "password" or "password_env")')
+        accounts.append({
+            'email': entry['email'],
+            'password': password,
+            'server': entry.get('server', 'imap.gmail.com'),
+            'port': entry.get('port'),
+            'ssl': entry.get('ssl', True),
+            'mailboxes': entry.get('mailboxes', ['INBOX']),
+            'connections': entry.get('connections'),
+        })
+    if not accounts:
+        raise ValueError(f'no accounts in {path}')
+    return accounts
+
+
+def prepare_parser(parser_obj, args, senders=None):
+    """Attach the --senders index, continue the --rollup and --anomalies files and enable metrics
+    
+    Loading the rollup first means reports counted by earlier runs are skipped.
+    """
+    parser_obj.senders = senders
+    if args.rollup:
+        parser_obj.rollup = FailureRollup.load(args.rollup)
+    if args.anomalies:
+        parser_obj.detector = AnomalyDetector.load(args.anomalies, args.baseline_days, args.spike_factor,
+                                                   args.spike_min)
+    if args.metrics or args.metrics_json or args.metrics_prom:
+        parser_obj.metrics = Metrics()
+
+
+def report_anomalies(parser_obj, args):
+    """Flag spikes, print the run's anomalies and save the --anomalies baseline
+    
+    With NDJSON output each anomaly is also written as a {"type": "new_sender"}
+    or {"type": "spike"} line.
+    """
+    detector = parser_obj.detector
+    if detector is None:
+        return
+    parser_obj.finish_parsing()
+    detector.detect_spikes()
+    detector.print_summary(args.top, parser_obj.senders)
+    if parser_obj.exporter is not None:
+        for anomaly in detector.anomalies:
+            parser_obj.exporter.write(anomaly)
+    detector.save()
+    # Seeding ends with the first run (or first --watch sync) that writes the baseline
+    detector.seeding = False
+
+
+def save_rollup(parser_obj, args):
+    if args.rollup:
+        parser_obj.rollup.save()
+        parser_obj.rollup.print_summary(args.top, args.domain, args.since, args.until)
+
+
+def save_metrics(parser_obj, args, summary=True):
+    if args.metrics_json:
+        parser_obj.metrics.save_json(args.metrics_json)
+    if args.metrics_prom:
+        parser_obj.metrics.save_prometheus(args.metrics_prom)
+    if args.metrics and summary:
+        parser_obj.metrics.print_summary()
+
+
+def run_watch(parser_obj, args, state):
+    """Run the --watch daemon until interrupted (Ctrl+C or SIGTERM)"""
+    
+    def report_sync():
+        # Report each sync on its own and persist everything before waiting again
+        if parser_obj.reports:
+            parser_obj.generate_report(args.detailed, args.top)
+            report_anomalies(parser_obj, args)
+            parser_obj.reports = []
+            parser_obj.failures = []
+            if parser_obj.detector is not None:
+                parser_obj.detector.anomalies = []
+        for sink in (parser_obj.store, parser_obj.cache):
+            if sink is not None:
+                sink.commit()
+        if parser_obj.exporter is not None:
+            parser_obj.exporter.flush()
+        if args.rollup:
+            parser_obj.rollup.save()
+        save_metrics(parser_obj, args, summary=False)
+    
+    daemon = WatchDaemon(parser_obj, args.mailbox, state, args.limit, args.batch_size, args.attachments_only,
+                         args.workers, args.poll_interval, args.idle_timeout, on_sync=report_sync)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+        daemon.drop_connection(logout=False)
+    print(f"\n{Colors.BLUE}Stopped watching after {daemon.syncs} syncs{Colors.END}")
+    save_metrics(parser_obj, args)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='DMARC Report Parser - Analyze email authentication failures',
@@ -407,21 +2984,116 @@ Examples:
   python dmarc_parser.py --email user@gmail.com --password "your_app_password"
   python dmarc_parser.py --email user@gmail.com --password "your_password" --limit 100
   python dmarc_parser.py --email user@gmail.com --password "your_password" --output my_report.json
+  python dmarc_parser.py --email user@gmail.com --password "your_password" --incremental
+  python dmarc_parser.py --email user@gmail.com --password "your_password" --store dmarc.db
+  python dmarc_parser.py --store dmarc.db --from-store --domain example.com --since 2025-01-01
+  python dmarc_parser.py --email user@gmail.com --password "your_password" --cache-dir dmarc_cache
+  python dmarc_parser.py --cache-dir dmarc_cache --from-cache
+  python dmarc_parser.py --from-path /archive/dmarc /archive/reports.mbox --parse-workers 4 --store dmarc.db
 
 Note: For Gmail, use an App Password instead of your regular password.
 Generate one at: https://myaccount.google.com/apppasswords
         """
     )
     
-    parser.add_argument('--email', required=True, help='Gmail email address')
-    parser.add_argument('--password', required=True, help='Gmail password or App Password')
+    parser.add_argument('--email', help='Gmail email address')
+    parser.add_argument('--config', metavar='FILE',
+                        help='JSON file of accounts and mailboxes to fetch concurrently into one report '
+                             '(instead of --email/--password/--mailbox)')
+    parser.add_argument('--password', help='Gmail password or App Password')
     parser.add_argument('--mailbox', default='INBOX', help='Mailbox to search (default: INBOX)')
     parser.add_argument('--limit', type=int, default=50, help='Maximum number of emails to process (default: 50)')
-    parser.add_argument('--output', default='dmarc_failures.json', help='Output JSON file path')
+    parser.add_argument('--batch-size', type=int, default=FETCH_BATCH_SIZE,
+                        help=f'Emails requested per IMAP FETCH command (default: {FETCH_BATCH_SIZE})')
+    parser.add_argument('--output', help='Output file path (default: dmarc_failures.json, or '
+                        'dmarc_failures.ndjson[.gz] for NDJSON)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='json',
+                        help='Output format: indented JSON, compact JSON without the duplicate failures list, '
+                             'or NDJSON (optionally gzipped) written while reports are parsed (default: json)')
     parser.add_argument('--server', default='imap.gmail.com', help='IMAP server (default: imap.gmail.com)')
+    parser.add_argument('--port', type=int, help='IMAP port (default: 993, or 143 with --no-ssl)')
+    parser.add_argument('--no-ssl', action='store_true', help='Connect without TLS (e.g. to a local test server)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Parallel IMAP connections used to download batches; with --config, '
+                             'connections per account (default: 1)')
+    parser.add_argument('--attachments-only', action='store_true',
+                        help='Screen emails on BODYSTRUCTURE and download only report attachments')
+    parser.add_argument('--parse-workers', type=int, default=1,
+                        help='Processes used to parse report attachments (default: 1)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Parse reports incrementally; exported reports keep a record count instead of records')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only fetch emails newer than the last run (uses --state-file)')
+    parser.add_argument('--state-file', default='dmarc_state.json',
+                        help='UID checkpoint file for --incremental (default: dmarc_state.json)')
+    parser.add_argument('--from-path', nargs='+', metavar='PATH',
+                        help='Ingest report files, .eml files, mbox files, Maildirs or directories of them '
+                             'instead of fetching emails')
+    parser.add_argument('--store', help='SQLite database that parsed reports are added to')
+    parser.add_argument('--from-store', action='store_true',
+                        help='Report on the reports in --store instead of fetching emails')
+    parser.add_argument('--domain', help='With --from-store: only include this domain')
+    parser.add_argument('--since', help='With --from-store: only include reports starting on/after YYYY-MM-DD')
+    parser.add_argument('--until', help='With --from-store: only include reports starting on/before YYYY-MM-DD')
+    parser.add_argument('--cache-dir', help='Directory caching raw report attachments for offline re-analysis')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='Attachment cache size limit in MB (default: 1024)')
+    parser.add_argument('--from-cache', action='store_true',
+                        help='Re-analyze the attachments in --cache-dir instead of fetching emails')
+    parser.add_argument('--rollup', help='JSON file of failure totals kept across runs (updated after each run)')
+    parser.add_argument('--from-rollup', nargs='*', metavar='FILE',
+                        help='Print the totals in --rollup, merged with any other rollup FILEs, instead of '
+                             'fetching emails (no credentials needed)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Entries shown per domain in the failure summary and in rollup summaries (default: 10)')
+    parser.add_argument('--detailed', action='store_true',
+                        help='Print every failure record with its recommendations instead of a summary')
+    parser.add_argument('--senders', metavar='FILE',
+                        help='Ranges file of authorized senders (CIDRs or SPF ip4:/ip6: terms, optionally labelled) '
+                             'used to classify failing source IPs')
+    parser.add_argument('--anomalies', metavar='FILE',
+                        help='Baseline file of failing senders and daily failure counts per domain, used to flag '
+                             'new failing senders and failure spikes (updated after each run)')
+    parser.add_argument('--spike-factor', type=float, default=3.0,
+                        help="With --anomalies: flag a day's failures above this multiple of the median of "
+                             "previous days (default: 3)")
+    parser.add_argument('--spike-min', type=int, default=20,
+                        help='With --anomalies: failed messages a day needs before it can be a spike (default: 20)')
+    parser.add_argument('--baseline-days', type=int, default=14,
+                        help='With --anomalies: days of history kept in the baseline (default: 14)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and process new reports as they arrive (IMAP IDLE, NOOP polling '
+                             'fallback); implies the --state-file checkpoint')
+    parser.add_argument('--poll-interval', type=float, default=60,
+                        help='With --watch: seconds between NOOP polls on servers without IDLE (default: 60)')
+    parser.add_argument('--idle-timeout', type=float, default=25 * 60,
+                        help='With --watch: seconds before an IDLE command is renewed (default: 1500)')
+    parser.add_argument('--metrics', action='store_true',
+                        help='Print per-stage timings, counters and error counts at the end of the run')
+    parser.add_argument('--metrics-json', metavar='FILE', help='Write run metrics to a JSON file')
+    parser.add_argument('--metrics-prom', metavar='FILE',
+                        help='Write run metrics in Prometheus text format (for the node_exporter textfile '
+                             'collector; rewritten after every --watch sync)')
     parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output for debugging')
     
     args = parser.parse_args()
+    if args.from_store and not args.store:
+        parser.error('--from-store requires --store')
+    if args.from_cache and not args.cache_dir:
+        parser.error('--from-cache requires --cache-dir')
+    if args.from_rollup is not None and not args.rollup:
+        parser.error('--from-rollup requires --rollup')
+    for path in args.from_rollup or ():
+        if not os.path.exists(path):
+            parser.error(f'--from-rollup: {path} does not exist')
+    if args.config and (args.watch or args.cache_dir or args.parse_workers > 1):
+        parser.error('--config cannot be combined with --watch, --cache-dir or --parse-workers')
+    for path in args.from_path or ():
+        if not os.path.exists(path):
+            parser.error(f'--from-path: {path} does not exist')
+    offline = args.from_store or args.from_cache or args.from_path or args.from_rollup is not None or args.config
+    if not offline and not (args.email and args.password):
+        parser.error('--email and --password are required')
     
     print(f"{Colors.BOLD}{Colors.CYAN}")
     print("╔═══════════════════════════════════════════════════════════╗")
@@ -430,17 +3102,116 @@ Generate one at: https://myaccount.google.com/apppasswords
     print("╚═══════════════════════════════════════════════════════════╝")
     print(f"{Colors.END}\n")
     
-    parser_obj = DMARCParser(args.email, args.password, args.server, args.verbose)
+    if args.from_rollup is not None:
+        rollup = FailureRollup.load(args.rollup)
+        for path in args.from_rollup:
+            try:
+                rollup.merge(FailureRollup.load(path))
+            except (OSError, ValueError) as e:
+                parser.error(f'--from-rollup: {path}: {e}')
+        rollup.print_summary(args.top, args.domain, args.since, args.until)
+        print(f"\n{Colors.GREEN}Done!{Colors.END}\n")
+        return
+    
+    accounts = None
+    if args.config:
+        try:
+            accounts = load_accounts(args.config)
+        except (OSError, ValueError) as e:
+            parser.error(f'--config: {e}')
+    
+    senders = None
+    if args.senders:
+        try:
+            senders = SenderIndex.load(args.senders)
+        except (OSError, ValueError) as e:
+            parser.error(f'--senders: {e}')
+        print(f"{Colors.BLUE}Loaded {len(senders)} authorized sender ranges from {args.senders}{Colors.END}")
+    
+    if args.output is None:
+        args.output = 'dmarc_failures.' + ('json' if args.format == 'compact' else args.format)
+    exporter = NDJSONExporter(args.output) if args.format.startswith('ndjson') else None
+    store = ReportStore(args.store) if args.store else None
+    cache = AttachmentCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+    
+    if args.from_store:
+        parser_obj = DMARCParser(args.email, args.password, args.server, args.verbose, exporter=exporter)
+        prepare_parser(parser_obj, args, senders)
+        try:
+            parser_obj.load_from_store(store, args.domain, args.since, args.until)
+            parser_obj.generate_report(args.detailed, args.top)
+            report_anomalies(parser_obj, args)
+            parser_obj.export_results(args.output, args.format)
+            save_rollup(parser_obj, args)
+            save_metrics(parser_obj, args)
+        finally:
+            if exporter is not None:
+                exporter.close()
+            store.close()
+        print(f"\n{Colors.GREEN}Done!{Colors.END}\n")
+        return
+    
+    if args.from_cache or args.from_path:
+        parser_obj = DMARCParser(args.email, args.password, args.server, args.verbose, args.stream,
+                                 args.parse_workers, store, None if args.from_cache else cache, exporter)
+        prepare_parser(parser_obj, args, senders)
+        try:
+            if args.from_cache:
+                parser_obj.parse_cached_attachments(cache)
+            else:
+                parser_obj.ingest_paths(args.from_path)
+            parser_obj.generate_report(args.detailed, args.top)
+            report_anomalies(parser_obj, args)
+            parser_obj.export_results(args.output, args.format)
+            save_rollup(parser_obj, args)
+            save_metrics(parser_obj, args)
+        finally:
+            if exporter is not None:
+                exporter.close()
+            if cache is not None:
+                cache.close()
+            if store is not None:
+                store.close()
+        print(f"\n{Colors.GREEN}Done!{Colors.END}\n")
+        return
+    
+    parser_obj = DMARCParser(args.email, args.password, args.server, args.verbose, args.stream,
+                             args.parse_workers, store, cache, exporter, args.port, not args.no_ssl)
+    prepare_parser(parser_obj, args, senders)
+    state = SyncState(args.state_file) if args.incremental or args.watch else None
     
-    if not parser_obj.connect():
+    if not (args.watch or accounts) and not parser_obj.connect():
         sys.exit(1)
     
     try:
-        parser_obj.fetch_dmarc_reports(args.mailbox, args.limit)
-        parser_obj.generate_report()
-        parser_obj.export_to_json(args.output)
+        if args.watch:
+            run_watch(parser_obj, args, state)
+        elif accounts:
+            parser_obj.fetch_accounts(accounts, args.limit, args.batch_size, state, args.attachments_only,
+                                      args.workers)
+            parser_obj.generate_report(args.detailed, args.top)
+            report_anomalies(parser_obj, args)
+            parser_obj.export_results(args.output, args.format)
+            save_rollup(parser_obj, args)
+            save_metrics(parser_obj, args)
+        else:
+            parser_obj.fetch_dmarc_reports(args.mailbox, args.limit, args.batch_size, state,
+                                            args.attachments_only, args.workers)
+            parser_obj.generate_report(args.detailed, args.top)
+            report_anomalies(parser_obj, args)
+            parser_obj.export_results(args.output, args.format)
+            save_rollup(parser_obj, args)
+            save_metrics(parser_obj, args)
     finally:
         parser_obj.disconnect()
+        if exporter is not None:
+            exporter.close()
+        if cache is not None:
+            cache.close()
+        if store is not None:
+            store.close()
+            print(f"{Colors.GREEN}✓ Stored {store.stored} new reports in {store.path} "
+                  f"({store.duplicates} duplicates skipped){Colors.END}")
     
     print(f"\n{Colors.GREEN}Done!{Colors.END}\n")
 
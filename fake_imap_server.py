@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+"""
+Fake IMAP Server - Local IMAP stand-in for testing the DMARC parser
+
+Serves in-memory mailboxes over plain (non-TLS) IMAP so the fetch, watch and
+benchmark code paths can run without a real mail account. Only the subset of
+IMAP4rev1 used by dmarc_parser.py is implemented: LOGIN, SELECT/EXAMINE,
+STATUS, SEARCH, FETCH (including BODYSTRUCTURE, ENVELOPE and BODY.PEEK[n]),
+their UID variants, NOOP and IDLE.
+"""
+
+import argparse
+import email
+import email.utils
+import mailbox
+import os
+import re
+import socketserver
+import sys
+import threading
+import time
+from email.header import decode_header, make_header
+from email.message import EmailMessage
+
+
+_TOKEN_RE = re.compile(
+    rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"\[\]]+(?:\[[^\]]*\](?:<[\d.]+>)?)?))'
+)
+
+
+def make_report_email(file_data, filename, domain='example.com', org_name='example.net',
+                      report_id='1', sender='noreply-dmarc-support@example.net'):
+    """Wrap a DMARC report attachment in an email as a reporter would send it"""
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['To'] = 'dmarc@' + domain
+    msg['Subject'] = f'Report Domain: {domain} Submitter: {org_name} Report-ID: <{report_id}>'
+    msg['Date'] = email.utils.formatdate()
+    msg['Message-ID'] = email.utils.make_msgid(domain=org_name)
+    msg.set_content('This is an aggregate report from ' + org_name + '.')
+    if filename.endswith('.zip'):
+        maintype, subtype = 'application', 'zip'
+    elif filename.endswith('.gz'):
+        maintype, subtype = 'application', 'gzip'
+    else:
+        maintype, subtype = 'text', 'xml'
+    if maintype == 'text':
+        msg.add_attachment(file_data.decode('utf-8'), subtype=subtype, filename=filename, cte='base64')
+    else:
+        msg.add_attachment(file_data, maintype=maintype, subtype=subtype, filename=filename)
+    return msg.as_bytes()
+
+
+class FakeMailbox:
+    """An in-memory IMAP mailbox with stable UIDs"""
+
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.messages = []  # [uid, raw bytes, flags]
+        self.next_uid = 1
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def add(self, raw):
+        with self.lock:
+            uid = self.next_uid
+            self.next_uid += 1
+            self.messages.append([uid, raw, set()])
+            listeners = list(self.listeners)
+            count = len(self.messages)
+        for listener in listeners:
+            listener.notify_exists(count)
+        return uid
+
+
+def _tokenize(data):
+    tokens = []
+    pos = 0
+    while pos < len(data):
+        match = _TOKEN_RE.match(data, pos)
+        if not match or match.end() == pos:
+            break
+        pos = match.end()
+        if match.group(1):
+            tokens.append('(')
+        elif match.group(2):
+            tokens.append(')')
+        elif match.group(3) is not None:
+            tokens.append(re.sub(rb'\\(.)', rb'\1', match.group(3)).decode('utf-8', 'replace'))
+        else:
+            tokens.append(match.group(4).decode('utf-8', 'replace'))
+    return tokens
+
+
+def _nest(tokens):
+    stack = [[]]
+    for token in tokens:
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            inner = stack.pop()
+            stack[-1].append(inner)
+        else:
+            stack[-1].append(token)
+    return stack[0]
+
+
+def _parse_set(spec, largest):
+    numbers = set()
+    for part in spec.split(','):
+        if ':' in part:
+            start, end = part.split(':')
+            start = largest if start == '*' else int(start)
+            end = largest if end == '*' else int(end)
+            numbers.update(range(min(start, end), max(start, end) + 1))
+        else:
+            numbers.add(largest if part == '*' else int(part))
+    return numbers
+
+
+def _literal(value):
+    if value is None:
+        return b'NIL'
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if re.search(rb'[\r\n"\\\x80-\xff]', value):
+        return b'{%d}\r\n' % len(value) + value
+    return b'"' + value + b'"'
+
+
+def _header_text(msg, name):
+    value = msg.get(name)
+    if value is None:
+        return ''
+    try:
+        return str(make_header(decode_header(str(value))))
+    except Exception:
+        return str(value)
+
+
+def _part_body(part):
+    raw = part.as_bytes()
+    for separator in (b'\r\n\r\n', b'\n\n'):
+        index = raw.find(separator)
+        if index != -1:
+            return raw[index + len(separator):]
+    return b''
+
+
+def _addresses(msg, name):
+    values = msg.get_all(name)
+    if not values:
+        return b'NIL'
+    entries = []
+    for display, address in email.utils.getaddresses([str(v) for v in values]):
+        mailbox_name, _, host = address.partition('@')
+        entries.append(b'(' + b' '.join([_literal(display or None), b'NIL',
+                                          _literal(mailbox_name or None), _literal(host or None)]) + b')')
+    return b'(' + b''.join(entries) + b')'
+
+
+def _envelope(msg):
+    from_addr = _addresses(msg, 'From')
+    fields = [
+        _literal(msg.get('Date')),
+        _literal(str(msg.get('Subject')) if msg.get('Subject') is not None else None),
+        from_addr,
+        _addresses(msg, 'Sender') if msg.get('Sender') else from_addr,
+        _addresses(msg, 'Reply-To') if msg.get('Reply-To') else from_addr,
+        _addresses(msg, 'To'),
+        _addresses(msg, 'Cc'),
+        _addresses(msg, 'Bcc'),
+        _literal(msg.get('In-Reply-To')),
+        _literal(msg.get('Message-ID')),
+    ]
+    return b'(' + b' '.join(fields) + b')'
+
+
+def _params(pairs):
+    if not pairs:
+        return b'NIL'
+    return b'(' + b' '.join(_literal(k) + b' ' + _literal(v) for k, v in pairs) + b')'
+
+
+def _bodystructure(part):
+    if part.get_content_type() != 'message/rfc822' and part.is_multipart():
+        children = b''.join(_bodystructure(child) for child in part.get_payload())
+        params = _params([(k, v) for k, v in (part.get_params() or [])[1:]])
+        return b'(' + children + b' ' + _literal(part.get_content_subtype()) + b' ' + params + b' NIL NIL NIL)'
+
+    body = _part_body(part)
+    params = _params([(k, v) for k, v in (part.get_params() or [])[1:]])
+    fields = [
+        _literal(part.get_content_maintype()),
+        _literal(part.get_content_subtype()),
+        params,
+        _literal(part.get('Content-ID')),
+        _literal(part.get('Content-Description')),
+        _literal(part.get('Content-Transfer-Encoding', '7bit')),
+        str(len(body)).encode(),
+    ]
+    if part.get_content_type() == 'message/rfc822':
+        inner = part.get_payload()[0]
+        fields += [_envelope(inner), _bodystructure(inner), str(body.count(b'\n')).encode()]
+    elif part.get_content_maintype() == 'text':
+        fields.append(str(body.count(b'\n')).encode())
+    disposition = part.get_content_disposition()
+    if disposition:
+        disp_params = _params([(k, v) for k, v in (part.get_params(header='content-disposition') or [])[1:]])
+        fields += [b'NIL', b'(' + _literal(disposition) + b' ' + disp_params + b')', b'NIL', b'NIL']
+    else:
+        fields += [b'NIL', b'NIL', b'NIL', b'NIL']
+    return b'(' + b' '.join(fields) + b')'
+
+
+def _get_part(msg, spec):
+    part = msg
+    for number in spec.split('.'):
+        number = int(number)
+        if part.get_content_type() == 'message/rfc822':
+            # Subparts of an encapsulated message are parts of its body
+            part = part.get_payload()[0]
+        if part.is_multipart():
+            children = part.get_payload()
+            if number > len(children):
+                return None
+            part = children[number - 1]
+        elif number != 1:
+            return None
+    return part
+
+
+class FakeIMAPHandler(socketserver.StreamRequestHandler):
+    """Handles one client connection"""
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.selected = None
+        self.readonly = False
+        self.known_exists = 0
+
+    def send(self, data):
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def notify_exists(self, count):
+        self.known_exists = count
+        try:
+            self.send(b'* %d EXISTS\r\n' % count)
+        except OSError:
+            pass
+
+    def handle(self):
+        self.send(b'* OK Fake IMAP server ready\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            # Client literals ({n}) are used by imaplib only for long strings
+            while re.search(rb'\{(\d+)\}\r\n$', line):
+                size = int(re.search(rb'\{(\d+)\}\r\n$', line).group(1))
+                self.send(b'+ go ahead\r\n')
+                literal = self.rfile.read(size)
+                line = line[:line.rfind(b'{')] + _literal(literal) + self.rfile.readline()
+            parts = line.rstrip(b'\r\n').split(b' ', 2)
+            if len(parts) < 2:
+                continue
+            tag = parts[0]
+            command = parts[1].decode().upper()
+            args = parts[2] if len(parts) > 2 else b''
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            if command == 'UID':
+                sub, _, args = args.partition(b' ')
+                command, uid_mode = sub.decode().upper(), True
+            else:
+                uid_mode = False
+            handler = getattr(self, 'cmd_' + command.lower(), None)
+            if handler is None:
+                self.send(tag + b' BAD unknown command\r\n')
+                continue
+            try:
+                if handler(tag, args, uid_mode) == 'logout':
+                    break
+            except Exception as e:
+                self.send(tag + b' BAD ' + str(e).encode() + b'\r\n')
+
+    def cmd_capability(self, tag, args, uid_mode):
+        self.send(b'* CAPABILITY ' + ' '.join(self.server.capabilities).encode() + b'\r\n')
+        self.send(tag + b' OK CAPABILITY completed\r\n')
+
+    def cmd_login(self, tag, args, uid_mode):
+        user, password = (_tokenize(args) + ['', ''])[:2]
+        expected = self.server.credentials
+        if expected and expected.get(user) != password:
+            self.send(tag + b' NO [AUTHENTICATIONFAILED] Invalid credentials\r\n')
+            return
+        self.send(tag + b' OK LOGIN completed\r\n')
+
+    def _select(self, tag, args, readonly):
+        name = _tokenize(args)[0]
+        box = self.server.mailboxes.get(name)
+        if box is None:
+            self.send(tag + b' NO mailbox does not exist\r\n')
+            return
+        if self.selected is not None:
+            self._unlisten()
+        self.selected = box
+        self.readonly = readonly
+        self.known_exists = len(box.messages)
+        self.send(b'* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)\r\n')
+        self.send(b'* %d EXISTS\r\n* 0 RECENT\r\n' % len(box.messages))
+        self.send(b'* OK [UIDVALIDITY %d] UIDs valid\r\n' % box.uidvalidity)
+        self.send(b'* OK [UIDNEXT %d] Predicted next UID\r\n' % box.next_uid)
+        mode = b'READ-ONLY' if readonly else b'READ-WRITE'
+        self.send(tag + b' OK [' + mode + b'] SELECT completed\r\n')
+
+    def cmd_select(self, tag, args, uid_mode):
+        self._select(tag, args, False)
+
+    def cmd_examine(self, tag, args, uid_mode):
+        self._select(tag, args, True)
+
+    def cmd_status(self, tag, args, uid_mode):
+        name = _tokenize(args)[0]
+        box = self.server.mailboxes.get(name)
+        if box is None:
+            self.send(tag + b' NO mailbox does not exist\r\n')
+            return
+        self.send(b'* STATUS ' + _literal(name) + b' (MESSAGES %d UIDNEXT %d UIDVALIDITY %d)\r\n'
+                  % (len(box.messages), box.next_uid, box.uidvalidity))
+        self.send(tag + b' OK STATUS completed\r\n')
+
+    def cmd_noop(self, tag, args, uid_mode):
+        if self.selected is not None and len(self.selected.messages) != self.known_exists:
+            self.known_exists = len(self.selected.messages)
+            self.send(b'* %d EXISTS\r\n' % self.known_exists)
+        self.send(tag + b' OK NOOP completed\r\n')
+
+    def cmd_close(self, tag, args, uid_mode):
+        self._unlisten()
+        self.selected = None
+        self.send(tag + b' OK CLOSE completed\r\n')
+
+    def cmd_logout(self, tag, args, uid_mode):
+        self._unlisten()
+        self.send(b'* BYE logging out\r\n' + tag + b' OK LOGOUT completed\r\n')
+        return 'logout'
+
+    def _unlisten(self):
+        if self.selected is not None:
+            with self.selected.lock:
+                if self in self.selected.listeners:
+                    self.selected.listeners.remove(self)
+
+    def cmd_idle(self, tag, args, uid_mode):
+        box = self.selected
+        with box.lock:
+            box.listeners.append(self)
+            pending = len(box.messages) != self.known_exists
+        self.send(b'+ idling\r\n')
+        if pending:
+            self.notify_exists(len(box.messages))
+        line = self.rfile.readline()
+        self._unlisten()
+        if line.strip().upper() != b'DONE':
+            self.send(tag + b' BAD expected DONE\r\n')
+            return 'logout' if not line else None
+        self.send(tag + b' OK IDLE terminated\r\n')
+
+    def _messages(self):
+        with self.selected.lock:
+            return list(enumerate(self.selected.messages, 1))
+
+    def _match(self, keys, seq, entry, largest_seq, largest_uid):
+        index = 0
+        while index < len(keys):
+            ok, index = self._match_key(keys, index, seq, entry, largest_seq, largest_uid)
+            if not ok:
+                return False
+        return True
+
+    def _match_key(self, keys, index, seq, entry, largest_seq, largest_uid):
+        key = keys[index]
+        if isinstance(key, list):
+            return self._match(key, seq, entry, largest_seq, largest_uid), index + 1
+        upper = key.upper()
+        if upper == 'ALL':
+            return True, index + 1
+        if upper == 'OR':
+            left, index = self._match_key(keys, index + 1, seq, entry, largest_seq, largest_uid)
+            right, index = self._match_key(keys, index, seq, entry, largest_seq, largest_uid)
+            return left or right, index
+        if upper == 'NOT':
+            result, index = self._match_key(keys, index + 1, seq, entry, largest_seq, largest_uid)
+            return not result, index
+        if upper == 'UID':
+            return entry[0] in _parse_set(keys[index + 1], largest_uid), index + 2
+        if upper in ('SUBJECT', 'FROM', 'TO', 'CC'):
+            msg = email.message_from_bytes(entry[1])
+            return keys[index + 1].lower() in _header_text(msg, upper.title()).lower(), index + 2
+        if upper in ('SINCE', 'BEFORE', 'ON', 'SENTSINCE', 'SENTBEFORE'):
+            return True, index + 2
+        if upper in ('SEEN', 'UNSEEN'):
+            return ('\\Seen' in entry[2]) == (upper == 'SEEN'), index + 1
+        if re.match(r'^[\d*:,]+$', key):
+            return seq in _parse_set(key, largest_seq), index + 1
+        raise ValueError('unsupported search key ' + key)
+
+    def cmd_search(self, tag, args, uid_mode):
+        keys = _nest(_tokenize(args))
+        if keys and isinstance(keys[0], str) and keys[0].upper() == 'CHARSET':
+            keys = keys[2:]
+        messages = self._messages()
+        largest_uid = messages[-1][1][0] if messages else 0
+        found = [str(entry[0] if uid_mode else seq)
+                 for seq, entry in messages
+                 if self._match(keys, seq, entry, len(messages), largest_uid)]
+        self.send(b'* SEARCH' + (b' ' + ' '.join(found).encode() if found else b'') + b'\r\n')
+        self.send(tag + b' OK SEARCH completed\r\n')
+
+    def cmd_fetch(self, tag, args, uid_mode):
+        spec, _, items = args.partition(b' ')
+        items = _nest(_tokenize(items))
+        if items and isinstance(items[0], list):
+            items = items[0]
+        items = [i.upper() for i in items]
+        macros = {'ALL': ['FLAGS', 'INTERNALDATE', 'RFC822.SIZE', 'ENVELOPE'],
+                  'FAST': ['FLAGS', 'INTERNALDATE', 'RFC822.SIZE']}
+        if len(items) == 1 and items[0] in macros:
+            items = macros[items[0]]
+        if uid_mode and 'UID' not in items:
+            items.insert(0, 'UID')
+        messages = self._messages()
+        if not messages:
+            self.send(tag + b' OK FETCH completed\r\n')
+            return
+        wanted = _parse_set(spec.decode(), messages[-1][1][0] if uid_mode else len(messages))
+        out = []
+        for seq, entry in messages:
+            if (entry[0] if uid_mode else seq) not in wanted:
+                continue
+            out.append(b'* %d FETCH (' % seq + b' '.join(self._fetch_items(entry, items)) + b')\r\n')
+        self.send(b''.join(out) + tag + b' OK FETCH completed\r\n')
+
+    def _fetch_items(self, entry, items):
+        uid, raw, flags = entry
+        msg = None
+        values = []
+        for item in items:
+            if item == 'UID':
+                values.append(b'UID %d' % uid)
+                continue
+            if item == 'FLAGS':
+                values.append(b'FLAGS (' + ' '.join(sorted(flags)).encode() + b')')
+                continue
+            if item == 'RFC822.SIZE':
+                values.append(b'RFC822.SIZE %d' % len(raw))
+                continue
+            if item == 'INTERNALDATE':
+                values.append(b'INTERNALDATE "01-Jan-2025 00:00:00 +0000"')
+                continue
+            if msg is None:
+                msg = email.message_from_bytes(raw)
+            if item == 'ENVELOPE':
+                values.append(b'ENVELOPE ' + _envelope(msg))
+            elif item in ('BODYSTRUCTURE', 'BODY'):
+                values.append(item.encode() + b' ' + _bodystructure(msg))
+            elif item in ('RFC822', 'RFC822.PEEK'):
+                if not self.readonly and item == 'RFC822':
+                    flags.add('\\Seen')
+                values.append(b'RFC822 {%d}\r\n' % len(raw) + raw)
+            elif item.startswith(('BODY[', 'BODY.PEEK[')):
+                section = item[item.index('[') + 1:item.index(']')]
+                if item.startswith('BODY[') and not self.readonly:
+                    flags.add('\\Seen')
+                if section == '':
+                    data = raw
+                elif section == 'HEADER':
+                    data = raw[:len(raw) - len(_part_body(msg))]
+                elif section == 'TEXT':
+                    data = _part_body(msg)
+                else:
+                    part = _get_part(msg, section)
+                    data = _part_body(part) if part is not None else b''
+                values.append(b'BODY[' + section.encode() + b'] {%d}\r\n' % len(data) + data)
+            else:
+                raise ValueError('unsupported fetch item ' + item)
+        return values
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """Threaded fake IMAP server holding one or more in-memory mailboxes"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, messages=(), host='127.0.0.1', port=0, credentials=None,
+                 capabilities=('IMAP4rev1', 'IDLE'), latency=0.0, mailboxes=('INBOX',)):
+        super().__init__((host, port), FakeIMAPHandler)
+        self.credentials = credentials
+        self.capabilities = capabilities
+        self.latency = latency
+        self.mailboxes = {name: FakeMailbox() for name in mailboxes}
+        for raw in messages:
+            self.add_message(raw)
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def add_message(self, raw, mailbox='INBOX'):
+        """Append a message and notify IDLE clients; returns its UID"""
+        return self.mailboxes[mailbox].add(raw)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def load_messages(paths):
+    """Load .eml/mbox files as-is and wrap .xml/.gz/.zip reports in emails"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                yield from load_messages(sorted(os.path.join(root, f) for f in files))
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if path.endswith(('.xml', '.gz', '.zip')):
+            yield make_report_email(data, os.path.basename(path))
+        elif data.startswith(b'From '):
+            for message in mailbox.mbox(path):
+                yield message.as_bytes()
+        else:
+            yield data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake IMAP server for testing the DMARC parser')
+    parser.add_argument('paths', nargs='*', help='.eml, mbox or .xml/.gz/.zip report files to serve')
+    parser.add_argument('--port', type=int, default=1143, help='Port to listen on (default: 1143)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Artificial per-command latency in seconds')
+    args = parser.parse_args()
+
+    server = FakeIMAPServer(load_messages(args.paths), port=args.port, latency=args.latency)
+    print(f"Serving {len(server.mailboxes['INBOX'].messages)} messages on 127.0.0.1:{server.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,7 @@ SCRIPT_DIR="/var/jenkins_home/scripts"  # Adjust to your path
 REPORT_DIR="/var/jenkins_home/dmarc_reports"  # Adjust to your path
 TIMESTAMP=$(date +%Y%m%d_%H%M%S)
 REPORT_FILE="${REPORT_DIR}/dmarc_failures_${TIMESTAMP}.json"
+STATE_FILE="${REPORT_DIR}/dmarc_state.json"  # UID checkpoints for incremental runs
 
 # Ensure directories exist
 mkdir -p "${REPORT_DIR}"
@@ -33,10 +34,14 @@ echo "======================================"
 echo ""
 
 # Run DMARC parser
+# --limit 0: the checkpoint already limits each run to new emails, and the
+# first run catches up on the whole mailbox instead of 100 emails per build
 python3 dmarc_parser.py \
   --email "${GMAIL_EMAIL}" \
   --password "${GMAIL_APP_PASSWORD}" \
-  --limit 100 \
+  --limit 0 \
+  --incremental \
+  --state-file "${STATE_FILE}" \
   --output "${REPORT_FILE}"
 
 EXIT_CODE=$?
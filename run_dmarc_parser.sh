@@ -29,6 +29,12 @@ MAILBOX=${MAILBOX:-INBOX}
 LIMIT=${LIMIT:-50}
 OUTPUT_FILE=${OUTPUT_FILE:-dmarc_failures_$(date +%Y%m%d_%H%M%S).json}
 
+# Incremental mode: only fetch emails newer than the previous run
+EXTRA_ARGS=()
+if [ -n "${STATE_FILE}" ]; then
+    EXTRA_ARGS+=(--incremental --state-file "${STATE_FILE}")
+fi
+
 echo "======================================"
 echo "DMARC Report Parser"
 echo "======================================"
@@ -37,6 +43,7 @@ echo "Server: ${IMAP_SERVER}"
 echo "Mailbox: ${MAILBOX}"
 echo "Limit: ${LIMIT}"
 echo "Output: ${OUTPUT_FILE}"
+echo "State file: ${STATE_FILE:-(full run)}"
 echo "======================================"
 echo ""
 
@@ -47,7 +54,8 @@ python3 dmarc_parser.py \
   --server "${IMAP_SERVER}" \
   --mailbox "${MAILBOX}" \
   --limit "${LIMIT}" \
-  --output "${OUTPUT_FILE}"
+  --output "${OUTPUT_FILE}" \
+  "${EXTRA_ARGS[@]}"
 
 EXIT_CODE=$?
 
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test DMARC Parser code paths that need no IMAP server
+Covers --from-path exports and the --senders ranges file; runs standalone or under pytest
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+from dmarc_parser import DMARCParser, SenderIndex
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def ingest(path, **options):
+    """Parse one local report file the way --from-path does and return the parser"""
+    parser = DMARCParser('test@example.com', 'dummy_password', **options)
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser.ingest_paths([path])
+    return parser
+
+
+def export(parser, compact):
+    """Run export_to_json() into a temporary file and return the loaded document"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'out.json')
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser.export_to_json(path, compact=compact)
+        with open(path) as f:
+            return json.load(f)
+
+
+def test_compact_export():
+    output = export(ingest(os.path.join(HERE, 'yahoo_report.xml')), compact=True)
+    assert 'failures' not in output
+    failing = [record for report in output['all_reports'] for record in report['records'] if record['has_failure']]
+    assert len(failing) == output['total_failures'] > 0
+
+
+def test_compact_stream_export_keeps_failures():
+    path = os.path.join(HERE, 'yahoo_report.xml')
+    full = export(ingest(path), compact=False)
+    output = export(ingest(path, stream=True), compact=True)
+    assert all('records' not in report for report in output['all_reports'])
+    assert len(output['failures']) == output['total_failures'] == full['total_failures'] > 0
+
+
+def test_sender_ranges_file():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ranges.txt')
+        with open(path, 'w') as f:
+            f.write('# label   ranges\n'
+                    'SendGrid  167.89.0.0/17 208.117.48.0/20\n'
+                    'Google    v=spf1 ip4:35.190.247.0/24 ip6:2001:4860:4000::/36 -ip4:35.190.247.8 ~all\n'
+                    '-ip4:10.0.0.0/8 ~ip4:172.16.0.0/12 ip4:192.0.2.0/24\n'
+                    '203.0.113.0/24\n')
+        index = SenderIndex.load(path)
+    assert len(index) == 6
+    assert index.label('167.89.1.1') == 'SendGrid'
+    assert index.lookup('35.190.247.8') == ('Google', '35.190.247.0/24')
+    assert index.label('2001:4860:4000::1') == 'Google'
+    assert index.lookup('192.0.2.7') == ('authorized', '192.0.2.0/24')
+    assert index.label('203.0.113.9') == 'authorized'
+    assert index.label('10.1.2.3') == index.label('172.16.0.1') == 'unknown'
+
+
+if __name__ == '__main__':
+    tests = [test_compact_export, test_compact_stream_export_keeps_failures, test_sender_ranges_file]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL  {test.__name__} {e}")
+    sys.exit(1 if failed else 0)
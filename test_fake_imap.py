@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Test DMARC Parser IMAP code paths against the local fake IMAP server
+Covers batched fetches, --attachments-only, incremental sync and --watch (IDLE)
+without a real mail account; runs standalone or under pytest
+"""
+
+import contextlib
+import gzip
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+from dmarc_parser import DMARCParser, SyncState, WatchDaemon
+from fake_imap_server import FakeIMAPServer, make_report_email
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def report_email(index):
+    """Report email number `index`, cycling through .xml, .xml.gz and .zip attachments"""
+    with open(os.path.join(HERE, 'sample_dmarc_report.xml'), 'rb') as f:
+        xml = f.read().replace(b'<report_id>1234567890</report_id>', b'<report_id>r%d</report_id>' % index)
+    kind = index % 3
+    if kind == 0:
+        return make_report_email(xml, f'r{index}.xml', report_id=f'r{index}')
+    if kind == 1:
+        return make_report_email(gzip.compress(xml), f'r{index}.xml.gz', report_id=f'r{index}')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr(f'r{index}.xml', xml)
+    return make_report_email(buffer.getvalue(), f'r{index}.zip', report_id=f'r{index}')
+
+
+def fetch(server, **options):
+    """Run one fetch_dmarc_reports() against the fake server and return the parser"""
+    parser = DMARCParser('test@example.com', 'dummy_password', '127.0.0.1', port=server.port, use_ssl=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert parser.connect()
+        parser.fetch_dmarc_reports(**options)
+        parser.disconnect()
+    return parser
+
+
+def report_ids(parser):
+    return [report['report_id'] for report in parser.reports]
+
+
+def test_batched_fetch():
+    server = FakeIMAPServer([report_email(i) for i in range(12)]).start()
+    try:
+        serial = fetch(server, limit=0, batch_size=5)
+        parallel = fetch(server, limit=0, batch_size=5, workers=3)
+    finally:
+        server.stop()
+    assert report_ids(serial) == [f'r{i}' for i in range(12)]
+    assert report_ids(parallel) == report_ids(serial)
+    assert len(parallel.failures) == len(serial.failures) > 0
+    assert serial.bytes_downloaded > 0
+
+
+def test_attachments_only_leaves_unseen():
+    server = FakeIMAPServer([report_email(i) for i in range(6)]).start()
+    try:
+        screened = fetch(server, limit=0, batch_size=4, attachments_only=True)
+        flags = [set(entry[2]) for entry in server.mailboxes['INBOX'].messages]
+        full = fetch(server, limit=0, batch_size=4)
+    finally:
+        server.stop()
+    assert report_ids(screened) == report_ids(full) == [f'r{i}' for i in range(6)]
+    assert screened.bytes_downloaded < full.bytes_downloaded
+    assert not any('\\Seen' in message_flags for message_flags in flags)
+
+
+def test_incremental_sync():
+    server = FakeIMAPServer([report_email(i) for i in range(5)]).start()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'state.json')
+        try:
+            # Oldest first, --limit emails per run, nothing skipped
+            assert report_ids(fetch(server, limit=3, state=SyncState(path))) == ['r0', 'r1', 'r2']
+            assert report_ids(fetch(server, limit=3, state=SyncState(path))) == ['r3', 'r4']
+            assert report_ids(fetch(server, limit=3, state=SyncState(path))) == []
+
+            server.add_message(report_email(5))
+            assert report_ids(fetch(server, limit=0, state=SyncState(path))) == ['r5']
+
+            # A new UIDVALIDITY invalidates the checkpoint
+            server.mailboxes['INBOX'].uidvalidity = 2
+            assert report_ids(fetch(server, limit=0, state=SyncState(path))) == [f'r{i}' for i in range(6)]
+            assert SyncState(path).get('test@example.com', '127.0.0.1', 'INBOX')['uidvalidity'] == 2
+        finally:
+            server.stop()
+
+
+def watch(server, until, **options):
+    """Run a WatchDaemon against the fake server; until(synced) adds mail and returns True when done"""
+    parser = DMARCParser('test@example.com', 'dummy_password', '127.0.0.1', port=server.port, use_ssl=False)
+    synced = []
+
+    def on_sync():
+        synced.append(report_ids(parser))
+        parser.reports = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        # A long poll interval, so only IDLE can pick up new messages in time
+        daemon = WatchDaemon(parser, state=SyncState(os.path.join(directory, 'state.json')),
+                             poll_interval=60, idle_timeout=30, on_sync=on_sync, **options)
+        with contextlib.redirect_stdout(io.StringIO()):
+            thread = threading.Thread(target=daemon.run)
+            thread.start()
+            try:
+                deadline = time.monotonic() + 5
+                while not until(synced) and time.monotonic() < deadline:
+                    time.sleep(0.01)
+            finally:
+                daemon.stop()
+                thread.join(5)
+                server.stop()
+    assert not thread.is_alive()
+    return synced
+
+
+def test_watch_idle_wakeup():
+    server = FakeIMAPServer([report_email(0)]).start()
+
+    def until(synced):
+        if len(synced) == 1 and len(server.mailboxes['INBOX'].messages) == 1:
+            server.add_message(report_email(1))
+        return len(synced) >= 2
+
+    assert watch(server, until) == [['r0'], ['r1']]
+
+
+def test_watch_works_through_backlog():
+    server = FakeIMAPServer([report_email(i) for i in range(8)]).start()
+
+    def until(synced):
+        if len(synced) == 3 and len(server.mailboxes['INBOX'].messages) == 8:
+            server.add_message(report_email(8))
+        return len(synced) >= 4
+
+    assert watch(server, until, limit=3) == [['r0', 'r1', 'r2'], ['r3', 'r4', 'r5'], ['r6', 'r7'], ['r8']]
+
+
+if __name__ == '__main__':
+    tests = [test_batched_fetch, test_attachments_only_leaves_unseen, test_incremental_sync, test_watch_idle_wakeup,
+             test_watch_works_through_backlog]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL  {test.__name__} {e}")
+    sys.exit(1 if failed else 0)